@@ -1,7 +1,9 @@
 import json
 from enum import Enum
 from pathlib import Path
-from typing import List
+from typing import List, Optional
+from pydobot.dobot import MODE_PTP_MOVL_XYZ
+from .motion_planning import MotionPlan, MotionPlanner
 from ..util import DobotPosition, DobotController
 
 
@@ -13,6 +15,9 @@ class DobotCarrierMotion(Enum):
 
 class DobotCarrier(DobotController):
 
+    pick_up_time = 0.4  # Seconds to wait for the suction cup to hold an item
+    release_time = 0.2  # Seconds to wait for the suction cup to release an item
+
     def carry_by_suction_cup(self, source: DobotPosition, waypoints: List[DobotPosition], destination: DobotPosition):
         """
         Carry an item using the suction cup.
@@ -32,11 +37,26 @@ class DobotCarrier(DobotController):
         # Put down
         self.__release_from_suction_cup(release_position=destination)
 
-    def playback(self, motions_json_path: Path):
+    def follow(self, motion_plan: MotionPlan, wait: bool = True):
+        """
+        Follow the waypoints of a motion plan by linear moves.
+
+        :param motion_plan: Result of MotionPlanner
+        :param wait: Whether to wait until Dobot reaches the last waypoint
+        """
+
+        for i, waypoint in enumerate(motion_plan.waypoints):
+            is_last = i == len(motion_plan.waypoints) - 1
+            self.move(destination=waypoint, ptp_mode=MODE_PTP_MOVL_XYZ, wait=wait and is_last)
+
+    def playback(self, motions_json_path: Path, motion_planner: Optional[MotionPlanner] = None) -> Optional[float]:
         """
         Playback carrying motions taught by DobotCarrierTeacher.
 
         :param motions_json_path: Path to JSON file that records motions
+        :param motion_planner: Planner that replaces the taught heights. If specified, the taught MOVE motions are
+                               skipped and Dobot moves between the PICK and RELEASE positions over the obstacles.
+        :return: Predicted seconds of the playback with the motion planner, or None without it
         """
 
         # Load motions
@@ -44,6 +64,9 @@ class DobotCarrier(DobotController):
             motions: list = json.load(motions_json)
         assert type(motions) is list
 
+        if motion_planner is not None:
+            return self.__playback_with_planner(motions=motions, motion_planner=motion_planner)
+
         # Playback motions
         for motion in motions:
             destination = DobotPosition._make(motion["dest"])
@@ -58,12 +81,43 @@ class DobotCarrier(DobotController):
             else:
                 assert False
 
+    def __playback_with_planner(self, motions: list, motion_planner: MotionPlanner) -> float:
+        position = self.current_position
+        is_holding = False
+        predicted_time = 0.0
+        for motion in motions:
+            destination = DobotPosition._make(motion["dest"])
+            motion_mode = DobotCarrierMotion(motion["motion"])
+            if motion_mode == DobotCarrierMotion.MOVE:
+                continue
+
+            held_item_height = motion_planner.held_item_height if is_holding else 0
+            motion_plan = motion_planner.transfer(source=position,
+                                                  destination=destination,
+                                                  held_item_height=held_item_height,
+                                                  lift=motion_planner.approach_clearance + held_item_height,
+                                                  descent=motion_planner.approach_clearance + held_item_height)
+            self.follow(motion_plan=motion_plan)
+            if motion_mode == DobotCarrierMotion.PICK:
+                self.__set_suction_cup_and_wait(is_on=True)
+                predicted_time += motion_plan.predicted_time + self.pick_up_time
+            else:
+                self.__set_suction_cup_and_wait(is_on=False)
+                predicted_time += motion_plan.predicted_time + self.release_time
+            position = destination
+            is_holding = motion_mode == DobotCarrierMotion.PICK
+
+        print(f"Predicted playback time: {predicted_time:.2f}s")
+        return predicted_time
+
     def __pick_up_by_suction_cup(self, target_position: DobotPosition):
         self.move(destination=target_position)
-        self.set_suction_cup(is_on=True)
-        self.wait(seconds=0.4)
+        self.__set_suction_cup_and_wait(is_on=True)
     
     def __release_from_suction_cup(self, release_position: DobotPosition):
         self.move(destination=release_position)
-        self.set_suction_cup(is_on=False)
-        self.wait(seconds=0.2)
+        self.__set_suction_cup_and_wait(is_on=False)
+
+    def __set_suction_cup_and_wait(self, is_on: bool):
+        self.set_suction_cup(is_on=is_on)
+        self.wait(seconds=self.pick_up_time if is_on else self.release_time)
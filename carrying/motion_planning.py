@@ -0,0 +1,277 @@
+import numpy as np
+from typing import Iterable, List, NamedTuple, Optional, Sequence, Tuple
+from ..util import DobotPosition
+
+
+class Obstacle(NamedTuple):
+    """
+    Box that Dobot must pass over, e.g. a bin wall or the release station.
+    """
+
+    x_min: float
+    x_max: float
+    y_min: float
+    y_max: float
+    top_z: float  # Height of the top surface
+    name: str = ""
+
+    def crossing(self, source: DobotPosition, destination: DobotPosition, margin: float) -> Optional[Tuple[float, float]]:
+        """
+        Horizontal overlap of a straight move with the footprint expanded by `margin`.
+
+        :return: Range of the move progress (0: source, 1: destination) over the obstacle, or None if it does not cross
+        """
+
+        t_min, t_max = 0.0, 1.0
+        for start, end, lower, upper in ((source.x, destination.x, self.x_min - margin, self.x_max + margin),
+                                         (source.y, destination.y, self.y_min - margin, self.y_max + margin)):
+            delta = end - start
+            if delta == 0:
+                if not lower <= start <= upper:
+                    return None
+                continue
+            t_lower, t_upper = sorted(((lower - start) / delta, (upper - start) / delta))
+            t_min, t_max = max(t_min, t_lower), min(t_max, t_upper)
+            if t_min > t_max:
+                return None
+        return t_min, t_max
+
+
+def bin_walls(x_min: float, x_max: float, y_min: float, y_max: float, top_z: float, thickness: float = 5) -> List[Obstacle]:
+    """
+    The four walls of a bin whose inner area is the specified range.
+    """
+
+    return [Obstacle(x_min - thickness, x_min, y_min - thickness, y_max + thickness, top_z, "bin wall x-"),
+            Obstacle(x_max, x_max + thickness, y_min - thickness, y_max + thickness, top_z, "bin wall x+"),
+            Obstacle(x_min, x_max, y_min - thickness, y_min, top_z, "bin wall y-"),
+            Obstacle(x_min, x_max, y_max, y_max + thickness, top_z, "bin wall y+")]
+
+
+class ArmTimingModel(NamedTuple):
+    """
+    Dobot timing of `settle_time + distance / speed` per move, the same model as InterceptPlanner and SimulatedArm.
+    """
+
+    speed: float = 200  # Mean Cartesian speed (Units: mm/s)
+    settle_time: float = 0.05  # Constant time added to every move (Units: s)
+
+    def move_time(self, source: DobotPosition, destination: DobotPosition) -> float:
+        distance = np.linalg.norm(np.subtract(destination[:3], source[:3]))
+        return float(self.settle_time + distance / self.speed)
+
+    def path_time(self, source: DobotPosition, waypoints: Iterable[DobotPosition]) -> float:
+        total_time = 0.0
+        for waypoint in waypoints:
+            total_time += self.move_time(source=source, destination=waypoint)
+            source = waypoint
+        return total_time
+
+
+class MotionPlan(NamedTuple):
+    source: DobotPosition
+    waypoints: List[DobotPosition]  # Linear moves in order. The last one is the destination.
+    predicted_time: float  # Seconds to follow the waypoints
+
+
+class PickMotionPlan(NamedTuple):
+    approach: MotionPlan  # From the current position to the item
+    retreat: MotionPlan  # From the item to the destination, or to the safe height if there is no destination
+    grasp_time: float  # Seconds to grasp the item between the approach and the retreat
+    predicted_cycle_time: float  # Seconds of the whole pick
+
+
+class MotionPlanner:
+    """
+    Plans moves with the lowest heights that still clear the known obstacles.
+
+    A transfer lifts vertically only as much as needed, moves linearly while climbing or descending over the obstacles,
+    and descends vertically at the destination, so that the heights follow the scene instead of fixed values.
+    The moves must be executed in linear mode because joint-interpolated moves do not follow the planned lines.
+    """
+
+    def __init__(self,
+                 obstacles: Sequence[Obstacle] = (),
+                 timing_model: ArmTimingModel = ArmTimingModel(),
+                 clearance: float = 5,
+                 approach_clearance: float = 10,
+                 tool_radius: float = 15,
+                 held_item_height: float = 20,
+                 max_z: float = 150):
+        """
+        :param obstacles: Obstacles in Dobot coordinates, e.g. from `bin_walls`
+        :param timing_model: Timing model of the arm to predict cycle times
+        :param clearance: Vertical margin over obstacles (Units: mm)
+        :param approach_clearance: Height above the item to descend and lift vertically (Units: mm)
+        :param tool_radius: Horizontal margin around obstacles covering the suction cup and a held item (Units: mm)
+        :param held_item_height: Height of an item hanging from the suction cup (Units: mm)
+        :param max_z: The max height Dobot can reach (Units: mm)
+        """
+
+        self.obstacles = obstacles
+        self.timing_model = timing_model
+        self.clearance = clearance
+        self.approach_clearance = approach_clearance
+        self.tool_radius = tool_radius
+        self.held_item_height = held_item_height
+        self.max_z = max_z
+
+    def safe_height(self, held_item_height: float = 0) -> float:
+        """
+        Height from which Dobot can move anywhere without touching the obstacles.
+        """
+
+        return max((obstacle.top_z for obstacle in self.obstacles), default=-np.inf) + \
+            self.clearance + held_item_height
+
+    def transfer(self,
+                 source: DobotPosition,
+                 destination: DobotPosition,
+                 held_item_height: float = 0,
+                 lift: float = 0,
+                 descent: float = 0) -> MotionPlan:
+        """
+        Plan the fastest safe move: an optional vertical lift, a linear climbing or descending traverse and
+        an optional vertical descent.
+
+        :param source: Current position
+        :param destination: Position to reach
+        :param held_item_height: Height of an item hanging from the suction cup (Units: mm)
+        :param lift: Min height of the vertical lift at the source, e.g. to pull an item out of the bulk (Units: mm)
+        :param descent: Min height of the vertical descent at the destination, e.g. onto an item (Units: mm)
+        """
+
+        start_z = source.z + lift
+        end_z = destination.z + descent
+        if (source.x, source.y) == (destination.x, destination.y):
+            end_z = min(end_z, max(start_z, destination.z))  # Already moving vertically onto the destination
+        constraints = self.__traverse_constraints(source=source,
+                                                  destination=destination,
+                                                  held_item_height=held_item_height)
+
+        # The minimal end height for each candidate start height. A flat traverse over the highest obstacle is one of them.
+        candidates = []
+        for traverse_start_z in {start_z, *(max(start_z, z) for _, z in constraints)}:
+            traverse_end_z = self.__min_end_z(start_z=traverse_start_z, end_z=end_z, constraints=constraints)
+            if traverse_end_z is None or max(traverse_start_z, traverse_end_z) > self.max_z:
+                continue
+            waypoints = self.__waypoints(source=source,
+                                         destination=destination,
+                                         traverse_start_z=traverse_start_z,
+                                         traverse_end_z=traverse_end_z)
+            candidates.append((self.timing_model.path_time(source=source, waypoints=waypoints), waypoints))
+        if not candidates:
+            raise ValueError(f"No move from {source} to {destination} clears the obstacles below z={self.max_z}.")
+
+        predicted_time, waypoints = min(candidates, key=lambda candidate: candidate[0])
+        return MotionPlan(source=source, waypoints=waypoints, predicted_time=predicted_time)
+
+    def plan_pick(self,
+                  current_position: DobotPosition,
+                  target_position: DobotPosition,
+                  destination: Optional[DobotPosition] = None,
+                  grasp_time: float = 0.8,
+                  held_item_height: Optional[float] = None) -> PickMotionPlan:
+        """
+        Plan a pick at the measured height of an item.
+
+        :param current_position: Current position
+        :param target_position: Position where the suction cup touches the item, i.e. the measured item height
+        :param destination: Position to carry the item to. Dobot lifts it to the safe height if None.
+        :param grasp_time: Seconds to grasp the item
+        :param held_item_height: Overrides `held_item_height`
+        """
+
+        held_item_height = self.held_item_height if held_item_height is None else held_item_height
+        approach = self.transfer(source=current_position, destination=target_position, descent=self.approach_clearance)
+
+        lift = self.approach_clearance + held_item_height
+        if destination is None:
+            safe_position = target_position._replace(z=max(target_position.z + lift,
+                                                           self.safe_height(held_item_height=held_item_height)))
+            retreat = MotionPlan(source=target_position,
+                                 waypoints=[safe_position],
+                                 predicted_time=self.timing_model.move_time(source=target_position,
+                                                                            destination=safe_position))
+        else:
+            retreat = self.transfer(source=target_position,
+                                    destination=destination,
+                                    held_item_height=held_item_height,
+                                    lift=lift)
+
+        return PickMotionPlan(approach=approach,
+                              retreat=retreat,
+                              grasp_time=grasp_time,
+                              predicted_cycle_time=approach.predicted_time + grasp_time + retreat.predicted_time)
+
+    def __traverse_constraints(self,
+                               source: DobotPosition,
+                               destination: DobotPosition,
+                               held_item_height: float) -> List[Tuple[float, float]]:
+        # Progress along the traverse and the min height there: [(t, z), ...]
+        constraints = []
+        for obstacle in self.obstacles:
+            crossing = obstacle.crossing(source=source, destination=destination, margin=self.tool_radius)
+            if crossing is None:
+                continue
+            min_z = obstacle.top_z + self.clearance + held_item_height
+            constraints.extend((t, min_z) for t in crossing)  # The height is linear, so both ends are enough
+        return constraints
+
+    @staticmethod
+    def __min_end_z(start_z: float, end_z: float, constraints: List[Tuple[float, float]]) -> Optional[float]:
+        # Lowest end height so that `start_z + (end - start_z) * t >= z` for all the constraints
+        for t, min_z in constraints:
+            if t == 0:
+                if start_z < min_z:
+                    return None
+            else:
+                end_z = max(end_z, (min_z - start_z * (1 - t)) / t)
+        return end_z
+
+    @staticmethod
+    def __waypoints(source: DobotPosition,
+                    destination: DobotPosition,
+                    traverse_start_z: float,
+                    traverse_end_z: float) -> List[DobotPosition]:
+        waypoints = []
+        for waypoint in (source._replace(z=max(traverse_start_z, source.z)),
+                         destination._replace(z=max(traverse_end_z, destination.z)),
+                         destination):
+            if waypoint != (waypoints[-1] if waypoints else source):
+                waypoints.append(waypoint)
+        return waypoints
+
+
+# Usage example
+if __name__ == "__main__":
+    from ..picking.conveyor_tracking import SimulatedArm, SimulatedClock, SyntheticConveyorScene
+
+    planner = MotionPlanner(obstacles=[*bin_walls(x_min=180, x_max=300, y_min=40, y_max=160, top_z=-10),
+                                       Obstacle(170, 230, -40, 40, top_z=-20, name="release station")])
+    home = DobotPosition(x=250, y=0, z=100, r_head=0)
+    release = DobotPosition(x=200, y=0, z=0, r_head=0)
+    for item_z in (-60, -45, -30):
+        measuring_position = DobotPosition(x=240, y=100, z=-25, r_head=0)
+        target = measuring_position._replace(z=item_z)
+        plan = planner.plan_pick(current_position=measuring_position, target_position=target, destination=release)
+
+        # Fixed heights: approach at z=-25 and retreat to z=85 before moving to the release position
+        fixed_waypoints = [target, target._replace(z=85), release]
+        fixed_time = planner.timing_model.path_time(source=measuring_position, waypoints=fixed_waypoints) + 0.8
+
+        # Follow the plan with the simulated arm that shares the timing model
+        clock = SimulatedClock()
+        arm = SimulatedArm(scene=SyntheticConveyorScene(items=np.empty(shape=(0, 2)), velocity=(0, 0)),
+                           clock=clock,
+                           home=measuring_position)
+        for waypoint in plan.approach.waypoints:
+            arm.move(destination=waypoint)
+        clock.advance(plan.grasp_time)
+        for waypoint in plan.retreat.waypoints:
+            arm.move(destination=waypoint)
+
+        print(f"item z={item_z}: predicted {plan.predicted_cycle_time:.3f}s, simulated {clock():.3f}s, "
+              f"fixed heights {fixed_time:.3f}s")
+        print(f"  approach: {[tuple(float(value) for value in point[:3]) for point in plan.approach.waypoints]}")
+        print(f"  retreat: {[tuple(float(value) for value in point[:3]) for point in plan.retreat.waypoints]}")
@@ -0,0 +1,216 @@
+import time
+import threading
+from enum import Enum
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple, Type, TypeVar
+from serial.tools import list_ports
+
+
+class DeviceKind(Enum):
+    SERIAL_PORT = "serial_port"
+    UVC_CAMERA = "uvc_camera"
+
+
+class DeviceIdentity(NamedTuple):
+    """
+    USB identity of a device. None matches any value, so that a product id alone is enough for a single device.
+    """
+
+    product_id: int
+    vendor_id: Optional[int] = None
+    serial_number: Optional[str] = None
+
+    def matches(self, other: "DeviceIdentity") -> bool:
+        return self.product_id == other.product_id and \
+            self.vendor_id in (None, other.vendor_id) and \
+            self.serial_number in (None, other.serial_number)
+
+
+class DeviceInfo(NamedTuple):
+    kind: DeviceKind
+    identity: DeviceIdentity
+    address: str  # Serial port name, e.g. '/dev/ttyUSB0', or UVC device uid, e.g. '1:5'
+    name: str
+
+
+class DeviceNotFoundError(Exception):
+    pass
+
+
+class Backoff(NamedTuple):
+    initial_delay: float = 0.05  # Seconds before the second attempt
+    factor: float = 2.0  # Multiplier of the delay after every failed attempt
+    max_delay: float = 0.4  # Cap of the delay between attempts
+    timeout: float = 10.0  # Seconds until giving up
+
+    def delays(self) -> Iterable[float]:
+        delay = self.initial_delay
+        while True:
+            yield delay
+            delay = min(delay * self.factor, self.max_delay)
+
+
+T = TypeVar("T")
+
+
+def retry_with_backoff(connect: Callable[[], T],
+                       exceptions: Tuple[Type[Exception], ...],
+                       backoff: Backoff = Backoff(),
+                       clock: Callable[[], float] = time.monotonic,
+                       sleep: Callable[[float], None] = time.sleep) -> T:
+    """
+    Call `connect` until it succeeds, sleeping with capped exponential backoff between attempts.
+    The last exception is raised when `backoff.timeout` passes.
+
+    :param connect: Function that opens a device and returns its handle
+    :param exceptions: Exceptions that mean the device is not ready yet
+    """
+
+    start = clock()
+    for delay in backoff.delays():
+        try:
+            return connect()
+        except exceptions:
+            if clock() - start + delay > backoff.timeout:
+                raise
+        sleep(delay)
+
+
+def serial_port_devices() -> List[DeviceInfo]:
+    return [DeviceInfo(kind=DeviceKind.SERIAL_PORT,
+                       identity=DeviceIdentity(product_id=port.pid, vendor_id=port.vid, serial_number=port.serial_number),
+                       address=port.device,
+                       name=port.description)
+            for port in list_ports.comports() if port.pid is not None]
+
+
+def uvc_camera_devices() -> List[DeviceInfo]:
+    from .pyuvc import uvc  # Only needed when the registry looks up cameras
+    return [DeviceInfo(kind=DeviceKind.UVC_CAMERA,
+                       identity=DeviceIdentity(product_id=device['idProduct'],
+                                               vendor_id=device['idVendor'],
+                                               serial_number=device['serialNumber']),
+                       address=device['uid'],
+                       name=device['name'])
+            for device in uvc.device_list()]
+
+
+DeviceChangeListener = Callable[[List[DeviceInfo], List[DeviceInfo]], None]
+
+
+class DeviceRegistry:
+    """
+    Cache of connected USB devices shared by the components of a picker.
+
+    Devices are enumerated once and looked up from the cache.
+    While watching, the devices are polled in a background thread and listeners are notified of hot-plug changes,
+    so that components can reconnect as soon as their device comes back instead of waiting for an I/O error.
+    """
+
+    def __init__(self,
+                 enumerators: Sequence[Callable[[], List[DeviceInfo]]] = (serial_port_devices,),
+                 poll_interval: float = 0.5):
+        """
+        :param enumerators: Functions that list the devices of each kind, e.g. serial_port_devices and uvc_camera_devices
+        :param poll_interval: Seconds between enumerations while watching
+        """
+
+        self.enumerators = enumerators
+        self.poll_interval = poll_interval
+        self.__devices: Dict[Tuple[DeviceKind, str], DeviceInfo] = {}
+        self.__listeners: List[DeviceChangeListener] = []
+        self.__lock = threading.Lock()
+        self.__watching = threading.Event()
+        self.__watcher: Optional[threading.Thread] = None
+        self.refresh()
+
+    @property
+    def devices(self) -> List[DeviceInfo]:
+        with self.__lock:
+            return list(self.__devices.values())
+
+    def refresh(self) -> Tuple[List[DeviceInfo], List[DeviceInfo]]:
+        """
+        Enumerate the devices again and notify the listeners of the changes.
+
+        :return: Added devices and removed devices
+        """
+
+        devices = {}
+        for enumerate_devices in self.enumerators:
+            for device in enumerate_devices():
+                devices[(device.kind, device.address)] = device
+
+        with self.__lock:
+            added = [device for key, device in devices.items() if self.__devices.get(key) != device]
+            removed = [device for key, device in self.__devices.items() if devices.get(key) != device]
+            self.__devices = devices
+            listeners = list(self.__listeners)
+
+        if added or removed:
+            for listener in listeners:
+                try:
+                    listener(added, removed)
+                except Exception as error:  # The other listeners must still be notified
+                    print(f"Device change listener {listener} failed: {error}")
+        return added, removed
+
+    def find(self, kind: DeviceKind, identity: DeviceIdentity, refresh: bool = False) -> DeviceInfo:
+        """
+        Look up a device in the cache.
+
+        :param kind: Kind of the device
+        :param identity: Identity to match
+        :param refresh: Whether to enumerate the devices before the lookup, e.g. when reconnecting
+        """
+
+        if refresh:
+            self.refresh()
+        try:
+            return next(device for device in self.devices if device.kind == kind and identity.matches(device.identity))
+        except StopIteration:
+            raise DeviceNotFoundError(f"No {kind.value} matches {identity}.")
+
+    def add_listener(self, listener: DeviceChangeListener):
+        """
+        :param listener: Function called with the added and removed devices. Called on the watcher thread while watching.
+        """
+
+        with self.__lock:
+            self.__listeners.append(listener)
+
+    def remove_listener(self, listener: DeviceChangeListener):
+        with self.__lock:
+            self.__listeners.remove(listener)
+
+    def start_watching(self):
+        if self.__watcher is not None:
+            return
+        self.__watching.set()
+        self.__watcher = threading.Thread(target=self.__watch, name="DeviceRegistryWatcher", daemon=True)
+        self.__watcher.start()
+
+    def stop_watching(self):
+        if self.__watcher is None:
+            return
+        self.__watching.clear()
+        self.__watcher.join()
+        self.__watcher = None
+
+    def __watch(self):
+        while self.__watching.is_set():
+            time.sleep(self.poll_interval)
+            try:
+                self.refresh()
+            except Exception as error:  # Keep watching through transient enumeration failures
+                print(f"Failed to enumerate devices: {error}")
+
+
+# Usage example
+if __name__ == "__main__":
+    registry = DeviceRegistry()
+    for info in registry.devices:
+        print(f"{info.kind.value}: {info.address} {info.name} {info.identity}")
+    registry.add_listener(lambda added, removed: print(f"added: {added}\nremoved: {removed}"))
+    registry.start_watching()
+    input("Plug or unplug a device to see the changes. Press Enter to stop.\n")
+    registry.stop_watching()
@@ -0,0 +1,525 @@
+import cv2
+import numpy as np
+from collections import deque
+from typing import Callable, List, NamedTuple, Optional, Tuple
+from .grasp_verification import SimulatedVacuumIO, SuctionGraspVerifier
+from .pickable_point_estimation import PickablePointEstimatorBackend
+from ..util import DobotPosition
+
+
+class ConveyorVelocityEstimator:
+    """
+    Estimates the conveyor velocity from item positions observed in successive frames.
+
+    Frames are only tens of milliseconds apart, so the displacements of the latest `window` frame pairs are summed
+    and divided by their total time. A position error then does not grow into a velocity error with every frame.
+    Pass the item centroids, not points adjusted to a clear picker window, which jump by the search step.
+    """
+
+    def __init__(self,
+                 max_match_distance: float = 30,
+                 window: int = 10,
+                 min_updates: int = 3,
+                 min_baseline: float = 0.15):
+        """
+        :param max_match_distance: Max distance (mm) between an item and its predicted position in the next frame
+        :param window: The number of latest frame pairs the velocity is estimated over
+        :param min_updates: The min number of matched frame pairs before the velocity is reported
+        :param min_baseline: The min total seconds of the matched frame pairs before the velocity is reported
+        """
+
+        self.max_match_distance = max_match_distance
+        self.window = window
+        self.min_updates = min_updates
+        self.min_baseline = min_baseline
+        self.velocity: Optional[np.ndarray] = None  # np.array([vx, vy]) (Units: mm/s). None until it is reliable.
+        self.__displacements = deque(maxlen=window)  # [(displacement, dt), ...] of matched frame pairs
+        self.__last_points: Optional[np.ndarray] = None
+        self.__last_timestamp: Optional[float] = None
+
+    def update(self, timestamp: float, points: np.ndarray) -> Optional[np.ndarray]:
+        """
+        Update the velocity with item positions in a new frame.
+
+        :param timestamp: Capture time of the frame (Units: s)
+        :param points: Item positions in Dobot coordinates: np.array([[x1, y1], ..., [xn, yn]])
+        :return: Estimated velocity or None until it is reliable
+        """
+
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        if self.__last_points is not None and len(points) > 0 and len(self.__last_points) > 0:
+            dt = timestamp - self.__last_timestamp
+            if dt > 0:
+                # Match every item with the nearest item of the last frame moved by the current estimate
+                predicted = self.__last_points + self.__windowed_velocity() * dt
+                distances = np.linalg.norm(points[:, np.newaxis] - predicted[np.newaxis], axis=2)
+                nearest = distances.argmin(axis=1)
+                matched = distances[np.arange(len(points)), nearest] <= self.max_match_distance
+                if matched.any():
+                    displacement = np.median(points[matched] - self.__last_points[nearest[matched]], axis=0)
+                    self.__displacements.append((displacement, dt))
+                    baseline = sum(pair_dt for _, pair_dt in self.__displacements)
+                    if len(self.__displacements) >= self.min_updates and baseline >= self.min_baseline:
+                        self.velocity = self.__windowed_velocity()
+        self.__last_points = points
+        self.__last_timestamp = timestamp
+        return self.velocity
+
+    def __windowed_velocity(self) -> np.ndarray:
+        if not self.__displacements:
+            return np.zeros(2)
+        total_displacement = np.sum([displacement for displacement, _ in self.__displacements], axis=0)
+        return total_displacement / sum(dt for _, dt in self.__displacements)
+
+    def predict(self, point: np.ndarray, observed_at: float, t: float) -> np.ndarray:
+        """
+        Predict the position of an item at the specified time.
+        """
+
+        velocity = self.velocity if self.velocity is not None else np.zeros(2)
+        return np.asarray(point, dtype=float) + velocity * (t - observed_at)
+
+
+class InterceptPlanner:
+    """
+    Plans where and when Dobot meets an item on the running conveyor.
+    The arm timing model is `settle_time + distance / speed` per move.
+    """
+
+    def __init__(self,
+                 speed: float = 200,
+                 settle_time: float = 0.05,
+                 approach_z: float = -25,
+                 pick_z: float = -45,
+                 reach: Tuple[float, float] = (150, 320),
+                 iterations: int = 5):
+        """
+        :param speed: Mean Cartesian speed of Dobot (Units: mm/s)
+        :param settle_time: Constant time added to every move (Units: s)
+        :param approach_z: Height above the item to reach before descending
+        :param pick_z: Height where the suction cup touches the item
+        :param reach: Min and max horizontal distances from the base that Dobot can reach (Units: mm)
+        :param iterations: The number of fixed-point iterations between contact time and contact position
+        """
+
+        self.speed = speed
+        self.settle_time = settle_time
+        self.approach_z = approach_z
+        self.pick_z = pick_z
+        self.reach = reach
+        self.iterations = iterations
+
+    def move_time(self, source: DobotPosition, destination: DobotPosition) -> float:
+        distance = np.linalg.norm(np.subtract(destination[:3], source[:3]))
+        return self.settle_time + distance / self.speed
+
+    def plan(self,
+             point: np.ndarray,
+             observed_at: float,
+             velocity: np.ndarray,
+             now: float,
+             current_position: DobotPosition) -> Optional[Tuple[DobotPosition, float]]:
+        """
+        Plan the interception of an item.
+
+        :param point: Item position in Dobot coordinates when observed
+        :param observed_at: Capture time of the frame the item was observed in
+        :param velocity: Conveyor velocity (Units: mm/s)
+        :param now: Current time on the same clock as `observed_at`
+        :param current_position: Current position of Dobot
+        :return: Position above the item at the contact time and the contact time, or None if it is out of reach
+        """
+
+        contact_time = now
+        above_item = None
+        for _ in range(self.iterations):
+            x, y = np.asarray(point, dtype=float) + np.asarray(velocity) * (contact_time - observed_at)
+            above_item = DobotPosition(x=x, y=y, z=self.approach_z, r_head=current_position.r_head)
+            descend_time = self.move_time(above_item, above_item._replace(z=self.pick_z))
+            contact_time = now + self.move_time(current_position, above_item) + descend_time
+
+        radius = np.hypot(above_item.x, above_item.y)
+        if not self.reach[0] <= radius <= self.reach[1]:
+            return None
+        return above_item, contact_time
+
+
+class ConveyorTrackingReport(NamedTuple):
+    attempts: int
+    picks: int
+    misses: int  # Attempts that did not grasp an item
+    skipped_observations: int  # Observations of items out of reach. An item is counted in every frame it is seen in.
+    elapsed: float  # Seconds from the start of tracking
+
+    @property
+    def throughput(self) -> float:
+        """
+        Picks per minute.
+        """
+
+        return self.picks / self.elapsed * 60 if self.elapsed > 0 else 0.0
+
+    @property
+    def miss_rate(self) -> float:
+        return self.misses / self.attempts if self.attempts > 0 else 0.0
+
+
+class ConveyorTracker:
+    """
+    Picks items from the running conveyor by intercepting their predicted positions.
+
+    The arm only has to provide `current_position`, `move`, `set_suction_cup` like DobotController,
+    so a simulated arm can be used for testing.
+    """
+
+    def __init__(self,
+                 arm,
+                 capture: Callable[[], Tuple[np.ndarray, float]],
+                 estimator: PickablePointEstimatorBackend,
+                 transform: Callable[[np.ndarray], np.ndarray],
+                 wait_for_seal: Callable[[], bool],
+                 is_grasped: Callable[[], bool],
+                 clock: Callable[[], float],
+                 sleep: Callable[[float], None],
+                 release_position: DobotPosition,
+                 velocity_estimator: ConveyorVelocityEstimator = None,
+                 planner: InterceptPlanner = None):
+        """
+        :param arm: DobotController or a stand-in
+        :param capture: Function that returns a bulk image and its capture time
+        :param estimator: Estimator backend for pickable points
+        :param transform: Function that transforms an image coordinate into Dobot coordinates
+        :param wait_for_seal: Function called right after the suction cup is turned on that waits for the vacuum and
+                              returns whether the suction cup has sealed on an item, e.g. SuctionGraspVerifier
+        :param is_grasped: Function that returns whether the suction cup still holds an item after lifting
+        :param clock: Clock of the capture times
+        :param sleep: Function that sleeps for the specified seconds
+        :param release_position: Position to release picked items
+        :param velocity_estimator: Estimator of the conveyor velocity. A new one is used if None.
+        :param planner: Interception planner. The default one is used if None.
+        """
+
+        self.arm = arm
+        self.capture = capture
+        self.estimator = estimator
+        self.transform = transform
+        self.wait_for_seal = wait_for_seal
+        self.is_grasped = is_grasped
+        self.clock = clock
+        self.sleep = sleep
+        self.release_position = release_position
+        self.velocity_estimator = velocity_estimator or ConveyorVelocityEstimator()
+        self.planner = planner or InterceptPlanner()
+
+        self.attempts = 0
+        self.picks = 0
+        self.misses = 0
+        self.skipped_observations = 0
+        self.started_at = clock()
+
+    @property
+    def report(self) -> ConveyorTrackingReport:
+        return ConveyorTrackingReport(attempts=self.attempts,
+                                      picks=self.picks,
+                                      misses=self.misses,
+                                      skipped_observations=self.skipped_observations,
+                                      elapsed=float(self.clock() - self.started_at))
+
+    def observe(self) -> Tuple[np.ndarray, float]:
+        """
+        Capture a frame and update the conveyor velocity with the item centroids.
+
+        :return: Points to pick up in Dobot coordinates and their capture time
+        """
+
+        image, observed_at = self.capture()
+        pickable_points = self.estimator.estimate_pickable_points(bulk_image=image)
+        centroids = np.array([self.transform(point) for point in pickable_points]).reshape(-1, 2)
+        self.velocity_estimator.update(timestamp=observed_at, points=centroids)
+
+        target_points = list(self.estimator.iterate_target_points(bulk_image=image, pickable_points=pickable_points))
+        points = np.array([self.transform(point) for point in target_points]).reshape(-1, 2)
+        return points, observed_at
+
+    def pick_next(self) -> Optional[bool]:
+        """
+        Observe the conveyor and intercept the first reachable item.
+
+        :return: Whether an item has been picked, or None if nothing was attempted
+        """
+
+        points, observed_at = self.observe()
+        velocity = self.velocity_estimator.velocity
+        if velocity is None:
+            return None
+
+        for point in points:
+            plan = self.planner.plan(point=point,
+                                     observed_at=observed_at,
+                                     velocity=velocity,
+                                     now=self.clock(),
+                                     current_position=self.arm.current_position)
+            if plan is None:
+                self.skipped_observations += 1
+                continue
+            above_item, contact_time = plan
+            return self.__intercept(above_item=above_item, contact_time=contact_time)
+        return None
+
+    def run(self, max_picks: int, max_cycles: int) -> ConveyorTrackingReport:
+        """
+        Keep picking until `max_picks` items are picked or `max_cycles` observations are made.
+        """
+
+        for _ in range(max_cycles):
+            if self.picks >= max_picks:
+                break
+            self.pick_next()
+        return self.report
+
+    def __intercept(self, above_item: DobotPosition, contact_time: float) -> bool:
+        self.attempts += 1
+        self.arm.move(destination=above_item, wait=True)
+
+        # Wait for the item if Dobot arrives early
+        descend_time = self.planner.move_time(above_item, above_item._replace(z=self.planner.pick_z))
+        waiting_time = contact_time - descend_time - self.clock()
+        if waiting_time > 0:
+            self.sleep(waiting_time)
+
+        self.arm.move(destination=above_item._replace(z=self.planner.pick_z), wait=True)
+        self.arm.set_suction_cup(is_on=True)
+
+        # Lifting before the vacuum has built up leaves the item on the conveyor
+        if not self.wait_for_seal():
+            self.misses += 1
+            self.arm.set_suction_cup(is_on=False)
+            self.arm.move(destination=above_item, wait=True)
+            return False
+        self.arm.move(destination=above_item, wait=True)
+
+        if self.is_grasped():
+            self.picks += 1
+            self.arm.move(destination=self.release_position, wait=True)
+            self.arm.set_suction_cup(is_on=False)
+            return True
+        self.misses += 1
+        self.arm.set_suction_cup(is_on=False)
+        return False
+
+
+# ---------- Simulation ---------- #
+
+class SimulatedClock:
+
+    def __init__(self, start: float = 0.0):
+        self.now = start
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += max(seconds, 0.0)
+
+
+class SyntheticConveyorScene:
+    """
+    Renders items moving on a conveyor as bulk images and judges whether a suction cup hits an item.
+    Item positions are in Dobot coordinates and images are rendered by the inverse of a linear pixel mapping.
+    """
+
+    background_color = (40, 40, 160)  # Red: outside the item hue band
+    item_color = (60, 180, 60)  # Green: inside the item hue band
+
+    def __init__(self,
+                 items: np.ndarray,
+                 velocity: Tuple[float, float],
+                 mm_per_pixel: float = 0.5,
+                 origin: Tuple[float, float] = (150, -160),
+                 image_size: Tuple[int, int] = (640, 480),
+                 item_radius: float = 15,
+                 pick_tolerance: float = 8):
+        """
+        :param items: Item positions at time 0 in Dobot coordinates: np.array([[x1, y1], ..., [xn, yn]])
+        :param velocity: Conveyor velocity (Units: mm/s)
+        :param mm_per_pixel: Scale of the camera
+        :param origin: Dobot coordinates of the image origin
+        :param image_size: (width, height) of rendered images
+        :param item_radius: Radius of the items (Units: mm)
+        :param pick_tolerance: Max distance (mm) between the suction cup and an item center to pick it up
+        """
+
+        self.items = np.asarray(items, dtype=float).reshape(-1, 2)
+        self.velocity = np.asarray(velocity, dtype=float)
+        self.mm_per_pixel = mm_per_pixel
+        self.origin = np.asarray(origin, dtype=float)
+        self.image_size = image_size
+        self.item_radius = item_radius
+        self.pick_tolerance = pick_tolerance
+        self.picked = np.zeros(len(self.items), dtype=bool)
+
+    def to_dobot(self, pixel: np.ndarray) -> np.ndarray:
+        return self.origin + np.asarray(pixel, dtype=float) * self.mm_per_pixel
+
+    def to_pixel(self, point: np.ndarray) -> np.ndarray:
+        return (np.asarray(point, dtype=float) - self.origin) / self.mm_per_pixel
+
+    def item_positions(self, t: float) -> np.ndarray:
+        return self.items + self.velocity * t
+
+    def render(self, t: float) -> np.ndarray:
+        width, height = self.image_size
+        image = np.full(shape=(height, width, 3), fill_value=self.background_color, dtype=np.uint8)
+        radius = int(round(self.item_radius / self.mm_per_pixel))
+        for position, picked in zip(self.item_positions(t), self.picked):
+            if not picked:
+                center = tuple(int(round(value)) for value in self.to_pixel(position))
+                cv2.circle(image, center=center, radius=radius, color=self.item_color, thickness=-1)
+        return image
+
+    def pick(self, point: np.ndarray, t: float) -> Optional[int]:
+        """
+        :return: Index of the item taken off the conveyor, or None if no item is under the suction cup
+        """
+
+        distances = np.linalg.norm(self.item_positions(t) - np.asarray(point)[:2], axis=1)
+        distances[self.picked] = np.inf
+        nearest = int(distances.argmin()) if len(distances) > 0 else None
+        if nearest is None or distances[nearest] > self.pick_tolerance:
+            return None
+        self.picked[nearest] = True
+        return nearest
+
+    def drop(self, item_index: int):
+        """
+        Put an item back on the conveyor, e.g. when it was lifted before the suction cup sealed.
+        """
+
+        self.picked[item_index] = False
+
+
+class SimulatedArm:
+    """
+    Stand-in for DobotController that follows the timing model of InterceptPlanner on a simulated clock.
+    The vacuum sensor is read with `io_adc` like DobotController. It only seals on an item some time after
+    the suction cup is turned on, and an item lifted before the pressure has dropped halfway stays on the conveyor.
+    """
+
+    def __init__(self,
+                 scene: SyntheticConveyorScene,
+                 clock: SimulatedClock,
+                 home: DobotPosition,
+                 speed: float = 200,
+                 settle_time: float = 0.05,
+                 pick_z: float = -45,
+                 seal_delay: float = 0.05,
+                 evacuation_time: float = 0.05):
+        """
+        :param seal_delay: Seconds from turning on the suction cup until the vacuum starts building up
+        :param evacuation_time: Seconds for the vacuum to build up after `seal_delay`
+        """
+
+        self.scene = scene
+        self.clock = clock
+        self.current_position = home
+        self.speed = speed
+        self.settle_time = settle_time
+        self.pick_z = pick_z
+        self.vacuum = SimulatedVacuumIO(seals=False,
+                                        seal_delay=seal_delay,
+                                        evacuation_time=evacuation_time,
+                                        clock=clock)
+        self.held_item: Optional[int] = None  # Index of the item under the suction cup
+        self.trajectory: List[Tuple[float, DobotPosition]] = [(clock(), home)]
+
+    @property
+    def is_holding(self) -> bool:
+        return self.held_item is not None and self.__is_evacuated()
+
+    def move(self, destination: DobotPosition, wait: bool = True):
+        if self.held_item is not None and destination.z > self.current_position.z and not self.__is_evacuated():
+            self.scene.drop(self.held_item)
+            self.held_item = None
+            self.vacuum.seals = False
+        distance = np.linalg.norm(np.subtract(destination[:3], self.current_position[:3]))
+        self.clock.advance(self.settle_time + distance / self.speed)
+        self.current_position = destination
+        self.trajectory.append((self.clock(), destination))
+
+    def set_suction_cup(self, is_on: bool):
+        if not is_on:
+            self.held_item = None
+            self.vacuum.seals = False
+        elif self.held_item is None and self.current_position.z <= self.pick_z:
+            self.held_item = self.scene.pick(point=np.array([self.current_position.x, self.current_position.y]),
+                                             t=self.clock())
+            self.vacuum.seals = self.held_item is not None
+            self.vacuum.restart()
+
+    def io_adc(self, address: int) -> int:
+        return self.vacuum.io_adc(address)
+
+    def __is_evacuated(self) -> bool:
+        return self.clock() - self.vacuum.start_time >= self.vacuum.seal_delay + self.vacuum.evacuation_time / 2
+
+
+def simulate_conveyor_tracking(estimator: PickablePointEstimatorBackend,
+                               velocity: Tuple[float, float] = (0, 40),
+                               item_num: int = 10,
+                               item_spacing: float = 50,
+                               frame_latency: float = 0.05,
+                               max_cycles: int = 100,
+                               seal_delay: float = 0.05,
+                               planner: InterceptPlanner = None) -> ConveyorTrackingReport:
+    """
+    Run ConveyorTracker against synthetic moving-scene frames and a simulated arm.
+
+    :param estimator: Estimator backend under test
+    :param velocity: Conveyor velocity (Units: mm/s)
+    :param item_num: The number of items on the conveyor
+    :param item_spacing: Distance between items along the conveyor (Units: mm)
+    :param frame_latency: Seconds from the exposure of a frame to the decision, added to the simulated clock
+    :param seal_delay: Seconds from turning on the suction cup until the vacuum starts building up
+    :param max_cycles: The max number of observations
+    :param planner: Interception planner. The default one is used if None.
+    """
+
+    planner = planner or InterceptPlanner()
+    direction = np.asarray(velocity, dtype=float) / max(np.linalg.norm(velocity), 1e-9)
+    start = np.array([230.0, -100.0])
+    items = start - direction * item_spacing * np.arange(item_num)[:, np.newaxis]
+    scene = SyntheticConveyorScene(items=items, velocity=velocity)
+    clock = SimulatedClock()
+    arm = SimulatedArm(scene=scene,
+                       clock=clock,
+                       home=DobotPosition(x=200, y=0, z=50, r_head=0),
+                       speed=planner.speed,
+                       settle_time=planner.settle_time,
+                       pick_z=planner.pick_z,
+                       seal_delay=seal_delay)
+    verifier = SuctionGraspVerifier(io=arm, address=1, seal_threshold=400, clock=clock, sleep=clock.advance)
+
+    def capture() -> Tuple[np.ndarray, float]:
+        captured_at = clock()
+        image = scene.render(captured_at)
+        clock.advance(frame_latency)
+        return image, captured_at
+
+    tracker = ConveyorTracker(arm=arm,
+                              capture=capture,
+                              estimator=estimator,
+                              transform=scene.to_dobot,
+                              wait_for_seal=lambda: verifier.wait_for_seal().is_sealed,
+                              is_grasped=verifier.is_sealed,
+                              clock=clock,
+                              sleep=clock.advance,
+                              release_position=DobotPosition(x=200, y=150, z=50, r_head=0),
+                              planner=planner)
+    return tracker.run(max_picks=item_num, max_cycles=max_cycles)
+
+
+# Usage example
+if __name__ == "__main__":
+    from .pickable_point_estimation import PickablePointEstimator
+    result = simulate_conveyor_tracking(estimator=PickablePointEstimator())
+    print(f"{result}\nthroughput: {result.throughput:.1f} picks/min, miss rate: {result.miss_rate:.2f}")
@@ -1,50 +1,125 @@
 import re
-from typing import List
-from serial import Serial
-from serial.tools import list_ports
-from serial.tools.list_ports_common import ListPortInfo
+from typing import List, Optional
+from serial import Serial, SerialException
+from ..device_registry import Backoff, DeviceIdentity, DeviceInfo, DeviceKind, DeviceNotFoundError, DeviceRegistry, \
+    retry_with_backoff
 
 
 class DistanceSensorError(Exception):
     pass
 
 
+ARDUINO_IDENTITY = DeviceIdentity(product_id=67)
+
+
+class DistanceSensor:
+    """
+    Distance sensor 'VL6180X' read via Arduino.
+    The serial port is kept open between measurements and reopened with backoff when the Arduino is replugged.
+    """
+
+    def __init__(self,
+                 device_registry: Optional[DeviceRegistry] = None,
+                 identity: DeviceIdentity = ARDUINO_IDENTITY,
+                 backoff: Backoff = Backoff()):
+        """
+        :param device_registry: Registry shared with the other components. A registry of serial ports is created if None.
+        :param identity: USB identity of the Arduino
+        :param backoff: Backoff of reconnection attempts
+        """
+
+        self.device_registry = device_registry or DeviceRegistry()
+        self.identity = identity
+        self.backoff = backoff
+        self.__serial: Optional[Serial] = None
+        self.__is_stale = False
+        self.device_registry.add_listener(self.__on_devices_changed)
+
+    def acquire_distance(self, times: int = 1) -> List[int]:
+        """
+        Acquire the distance sensor value.
+
+        :params times: The number of times to acquire value.
+        :return: Distance value list returned from the sensor (Units: mm).
+                 The list size equals to the specified `times`.
+        """
+
+        try:
+            return self.__read(times=times)
+        except SerialException:
+            self.reconnect()
+            return self.__read(times=times)
+
+    def reconnect(self):
+        self.close()
+        self.__serial = retry_with_backoff(connect=lambda: self.__open(refresh=True),
+                                           exceptions=(SerialException, DistanceSensorError),
+                                           backoff=self.backoff)
+
+    def close(self):
+        if self.__serial is not None:
+            try:
+                self.__serial.close()
+            except SerialException:
+                pass
+            self.__serial = None
+
+    def __open(self, refresh: bool) -> Serial:
+        # Find Arduino port
+        try:
+            arduino_port = self.device_registry.find(kind=DeviceKind.SERIAL_PORT, identity=self.identity, refresh=refresh)
+        except DeviceNotFoundError:
+            raise DistanceSensorError("The distance sensor not found.")
+        self.__is_stale = False
+        return Serial(port=arduino_port.address)
+
+    def __read(self, times: int) -> List[int]:
+        if self.__is_stale:
+            self.reconnect()
+        elif self.__serial is None:
+            self.__serial = self.__open(refresh=False)
+        serial = self.__serial
+
+        # Skip values sent while nobody was reading and the partial line after them
+        serial.reset_input_buffer()
+        serial.readline()
+
+        # Acquire distance
+        results = []
+        while len(results) < times:
+            serial_value = serial.readline()
+            distance_search_result = re.search(pattern=r'\d+', string=str(serial_value))  # Extract distance value
+            try:
+                distance_str = distance_search_result.group()
+                results.append(int(distance_str))
+            except AttributeError:
+                continue
+        assert len(results) == times
+        return results
+
+    def __on_devices_changed(self, added: List[DeviceInfo], removed: List[DeviceInfo]):
+        serial = self.__serial  # Called on the watcher thread while `close` can set it to None
+        if serial is not None and \
+                any(device.kind == DeviceKind.SERIAL_PORT and device.address == serial.port for device in removed):
+            self.__is_stale = True
+
+
+__default_sensor: Optional[DistanceSensor] = None
+
+
 def acquire_distance(times: int = 1) -> List[int]:
     """
-    Acquire the distance sensor value via Arduino. The sensor model is 'VL6180X'.
+    Acquire the distance sensor value via Arduino with a sensor shared in the process. The sensor model is 'VL6180X'.
 
     :params times: The number of times to acquire value.
     :return: Distance value list returned from the sensor (Units: mm).
              The list size equals to the specified `times`.
     """
 
-    # Find Arduino port
-    arduino_port = __find_arduino_port()
-    serial = Serial(port=arduino_port.device)
-
-    # Acquire distance
-    results = []
-    while len(results) < times:
-        serial_value = serial.readline()
-        distance_search_result = re.search(pattern=r'\d+', string=str(serial_value))  # Extract distance value
-        try:
-            distance_str = distance_search_result.group()
-            results.append(int(distance_str))
-        except AttributeError:
-            continue
-    serial.close()
-    assert len(results) == times
-    return results
-
-
-def __find_arduino_port() -> ListPortInfo:
-    ports = list_ports.comports()
-    arduino_pid = 67
-    
-    try:
-        return next(port for port in ports if port.pid == arduino_pid)
-    except StopIteration:
-        raise DistanceSensorError("The distance sensor not found.")
+    global __default_sensor
+    if __default_sensor is None:
+        __default_sensor = DistanceSensor()
+    return __default_sensor.acquire_distance(times=times)
 
 
 if __name__ == "__main__":
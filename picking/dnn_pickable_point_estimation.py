@@ -0,0 +1,151 @@
+import cv2
+import numpy as np
+from pathlib import Path
+from typing import Iterator, List, Optional, Sequence, Tuple
+from .pickable_point_estimation import PickablePointEstimatorBackend
+
+
+class DnnPickablePointEstimator(PickablePointEstimatorBackend):
+    """
+    Learned estimator that predicts a suction score heatmap on CPU.
+
+    The model takes a float32 NCHW batch of BGR images scaled to [0, 1] and resized to `input_size`,
+    and outputs suction scores in [0, 1] shaped (N, 1, H', W') or (N, H', W').
+    """
+
+    engines = ("opencv", "onnxruntime")
+
+    def __init__(self,
+                 model_path: Path,
+                 input_size: Tuple[int, int] = (320, 240),
+                 score_threshold: float = 0.5,
+                 peak_distance: int = 5,
+                 max_points: int = 10,
+                 engine: str = "opencv",
+                 warmup_batch_size: int = 1):
+        """
+        :param model_path: ONNX model (or any format cv2.dnn.readNet accepts when engine is 'opencv')
+        :param input_size: Model input size: (width, height)
+        :param score_threshold: Min suction score of a pickable point
+        :param peak_distance: Min distance between pickable points in heatmap pixels
+        :param max_points: The max number of pickable points per image
+        :param engine: 'opencv' for OpenCV DNN or 'onnxruntime' for ONNX Runtime
+        :param warmup_batch_size: Batch size expected in `estimate_target_points`.
+                                  Single images are warmed up as well for `estimate_pickable_points`.
+        """
+
+        if engine not in self.engines:
+            raise ValueError(f"Unknown engine '{engine}'. Choose from {self.engines}.")
+        self.model_path = model_path
+        self.input_size = input_size
+        self.score_threshold = score_threshold
+        self.peak_distance = peak_distance
+        self.max_points = max_points
+        self.engine = engine
+
+        if engine == "opencv":
+            self.__net = cv2.dnn.readNet(str(model_path))
+            self.__net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+            self.__net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        else:
+            import onnxruntime  # Optional dependency only needed for this engine
+            self.__session = onnxruntime.InferenceSession(str(model_path), providers=["CPUExecutionProvider"])
+            self.__input_name = self.__session.get_inputs()[0].name
+
+        # Warm up so that the first pick does not pay for lazy initialization.
+        # The engines allocate buffers per batch size, so every expected size is warmed up.
+        width, height = input_size
+        for batch_size in sorted({1, warmup_batch_size}):
+            self.predict_heatmaps([np.zeros(shape=(height, width, 3), dtype=np.uint8)] * batch_size)
+
+    def predict_heatmaps(self, bulk_images: Sequence[np.ndarray]) -> np.ndarray:
+        """
+        Predict suction score heatmaps in one batch.
+
+        :param bulk_images: BGR images of items in bulk
+        :return: Heatmaps: np.array of shape (N, H', W')
+        """
+
+        blob = cv2.dnn.blobFromImages(images=list(bulk_images),
+                                      scalefactor=1 / 255,
+                                      size=self.input_size,
+                                      swapRB=False,
+                                      crop=False)
+        if self.engine == "opencv":
+            self.__net.setInput(blob)
+            heatmaps = self.__net.forward()
+        else:
+            heatmaps = self.__session.run(None, {self.__input_name: blob})[0]
+        if heatmaps.ndim == 4:
+            heatmaps = heatmaps[:, 0]
+        return heatmaps
+
+    def estimate_pickable_points(self, bulk_image: np.ndarray, show_result: bool = False) -> np.ndarray:
+        heatmap = self.predict_heatmaps([bulk_image])[0]
+        pickable_points = self.__pickable_points(heatmap=heatmap, image_shape=bulk_image.shape)
+
+        if show_result:
+            plot_image = self.__plot_image(source_image=bulk_image, heatmap=heatmap, coordinates=pickable_points)
+            cv2.imshow('result', plot_image)
+            cv2.waitKey(0)
+
+        return pickable_points
+
+    def iterate_target_points(self,
+                              bulk_image: np.ndarray,
+                              pickable_points: np.ndarray,
+                              show_result: bool = False) -> Iterator[np.ndarray]:
+        # Peaks of the suction score are already the points to pick up
+        return iter(pickable_points)
+
+    def estimate_target_points(self,
+                               bulk_images: Sequence[np.ndarray]) -> List[Tuple[np.ndarray, Optional[np.ndarray]]]:
+        heatmaps = self.predict_heatmaps(bulk_images)
+        results = []
+        for bulk_image, heatmap in zip(bulk_images, heatmaps):
+            pickable_points = self.__pickable_points(heatmap=heatmap, image_shape=bulk_image.shape)
+            results.append((pickable_points, pickable_points[0] if len(pickable_points) > 0 else None))
+        return results
+
+    def __pickable_points(self, heatmap: np.ndarray, image_shape: tuple) -> np.ndarray:
+        # Local maxima above the threshold in descending order of the score
+        kernel = np.ones(shape=(2 * self.peak_distance + 1, 2 * self.peak_distance + 1), dtype=np.uint8)
+        dilated_heatmap = cv2.dilate(src=heatmap, kernel=kernel)
+        rows, cols = np.nonzero((heatmap == dilated_heatmap) & (heatmap >= self.score_threshold))
+        sorted_order = np.argsort(-heatmap[rows, cols], kind="stable")
+
+        # Every pixel of a plateau is a local maximum, so keep only one peak within `peak_distance`
+        order = []
+        for index in sorted_order:
+            if all(max(abs(rows[index] - rows[kept]), abs(cols[index] - cols[kept])) > self.peak_distance
+                   for kept in order):
+                order.append(index)
+                if len(order) == self.max_points:
+                    break
+        order = np.array(order, dtype=int)
+
+        # Heatmap pixel centers -> image coordinates
+        scale_x = image_shape[1] / heatmap.shape[1]
+        scale_y = image_shape[0] / heatmap.shape[0]
+        xs = ((cols[order] + 0.5) * scale_x).astype(int)
+        ys = ((rows[order] + 0.5) * scale_y).astype(int)
+        return np.stack([xs, ys], axis=1)
+
+    def __plot_image(self, source_image: np.ndarray, heatmap: np.ndarray, coordinates: np.ndarray) -> np.ndarray:
+        scores = cv2.resize(src=heatmap, dsize=(source_image.shape[1], source_image.shape[0]))
+        colored_scores = cv2.applyColorMap(src=np.uint8(np.clip(scores, 0, 1) * 255), colormap=cv2.COLORMAP_JET)
+        plot_image = cv2.addWeighted(src1=source_image, alpha=0.6, src2=colored_scores, beta=0.4, gamma=0)
+        for i, coordinate in enumerate(coordinates):
+            plot_image = cv2.drawMarker(plot_image,
+                                        position=tuple(int(value) for value in coordinate),
+                                        color=(0, 0, 255),
+                                        markerType=cv2.MARKER_STAR,
+                                        markerSize=10)
+            plot_image = cv2.putText(plot_image,
+                                     text=str(i+1),
+                                     org=(max(int(coordinate[0]) - 10, 0), max(int(coordinate[1]) - 10, 0)),
+                                     fontFace=cv2.FONT_HERSHEY_SIMPLEX,
+                                     fontScale=0.4,
+                                     color=(0, 0, 255),
+                                     thickness=1)
+        return plot_image
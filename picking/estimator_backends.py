@@ -0,0 +1,120 @@
+import time
+import tracemalloc
+import numpy as np
+from typing import Callable, Dict, NamedTuple, Sequence, Type
+from .dnn_pickable_point_estimation import DnnPickablePointEstimator
+from .pickable_point_estimation import PickablePointEstimator, PickablePointEstimatorBackend
+
+
+ESTIMATOR_BACKENDS: Dict[str, Type[PickablePointEstimatorBackend]] = {
+    "classical": PickablePointEstimator,
+    "dnn": DnnPickablePointEstimator,
+}
+
+
+class EstimationAllocations(NamedTuple):
+    first_call_peak: int  # Peak bytes allocated by the first call, including the workspace
+    steady_state_peak: int  # Max peak bytes allocated by a call after the first one
+    steady_state_retained: int  # Bytes still allocated after the steady-state calls
+
+
+def create_pickable_point_estimator(backend: str = "classical", **options) -> PickablePointEstimatorBackend:
+    """
+    Create an estimator backend by its name, e.g. from a configuration file.
+
+    :param backend: One of ESTIMATOR_BACKENDS
+    :param options: Keyword arguments of the backend's constructor
+    """
+
+    try:
+        backend_class = ESTIMATOR_BACKENDS[backend]
+    except KeyError:
+        raise ValueError(f"Unknown estimator backend '{backend}'. Choose from {list(ESTIMATOR_BACKENDS)}.")
+    return backend_class(**options)
+
+
+def measure_estimation_latency(estimator: PickablePointEstimatorBackend,
+                               bulk_images: Sequence[np.ndarray],
+                               batch_size: int = 1,
+                               repeat: int = 3) -> float:
+    """
+    Measure the mean seconds per image to estimate target points.
+
+    :param estimator: Estimator backend to measure
+    :param bulk_images: Images shared by all the measured backends
+    :param batch_size: The number of images passed to `estimate_target_points` at once
+    :param repeat: The number of times to process all the images. The fastest run is taken.
+    """
+
+    elapsed_times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for i in range(0, len(bulk_images), batch_size):
+            estimator.estimate_target_points(bulk_images[i:i+batch_size])
+        elapsed_times.append(time.perf_counter() - start)
+    return min(elapsed_times) / len(bulk_images)
+
+
+def measure_estimation_allocations(estimator: PickablePointEstimatorBackend,
+                                   bulk_image: np.ndarray,
+                                   calls: int = 20) -> EstimationAllocations:
+    """
+    Measure the memory allocated by repeated `estimate_target_point` calls on frames of one size with tracemalloc.
+    NumPy reports its buffers to tracemalloc, so OpenCV outputs allocated as new arrays are counted.
+    Tracing is restarted during the measurement, so traces of a caller that was already tracing are discarded.
+
+    :param estimator: Estimator backend to measure
+    :param bulk_image: Image of items in bulk
+    :param calls: The number of steady-state calls after the first one
+    """
+
+    was_tracing = tracemalloc.is_tracing()
+    try:
+        # Tracing is restarted around each call instead of resetting the peak, which needs Python 3.9
+        first_call_peak = _traced_peak(lambda: estimator.estimate_target_point(bulk_image=bulk_image))
+        steady_state_peak = max(_traced_peak(lambda: estimator.estimate_target_point(bulk_image=bulk_image))
+                                for _ in range(calls))
+
+        # Memory still allocated after the steady-state calls, traced over all of them
+        _restart_tracing()
+        for _ in range(calls):
+            estimator.estimate_target_point(bulk_image=bulk_image)
+        steady_state_retained, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        if was_tracing:
+            tracemalloc.start()
+    return EstimationAllocations(first_call_peak=first_call_peak,
+                                 steady_state_peak=steady_state_peak,
+                                 steady_state_retained=steady_state_retained)
+
+
+def _restart_tracing():
+    # Only blocks allocated after this are traced, and the peak starts from zero
+    tracemalloc.stop()
+    tracemalloc.start()
+
+
+def _traced_peak(function: Callable[[], object]) -> int:
+    _restart_tracing()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    return peak
+
+
+# Usage example
+if __name__ == "__main__":
+    import cv2
+    from pathlib import Path
+    image_dir_str = input("Enter a path to a directory of bulk images.\n>> ")
+    model_path_str = input("Enter a path to a suction score ONNX model.\n>> ")
+    images = [cv2.imread(str(path)) for path in sorted(Path(image_dir_str).glob("*.png"))]
+    classical = create_pickable_point_estimator("classical")
+    dnn = create_pickable_point_estimator("dnn", model_path=Path(model_path_str))
+    print(f"classical: {measure_estimation_latency(classical, images) * 1000:.1f}ms/image")
+    for size in (1, 4, 8):
+        print(f"dnn (batch {size}): {measure_estimation_latency(dnn, images, batch_size=size) * 1000:.1f}ms/image")
+    allocations = measure_estimation_allocations(classical, images[0])
+    print(f"classical allocations: first call {allocations.first_call_peak / 1024:.1f}KiB, "
+          f"steady state {allocations.steady_state_peak / 1024:.1f}KiB/call "
+          f"(frame: {images[0].nbytes / 1024:.1f}KiB)")
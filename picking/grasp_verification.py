@@ -0,0 +1,162 @@
+import time
+from typing import Callable, List, NamedTuple, Optional, Sequence
+
+
+class GraspVerification(NamedTuple):
+    is_sealed: bool
+    elapsed: float  # Seconds from the start of the verification to the decision
+    values: List[int]  # Polled sensor values
+
+
+class SuctionGraspVerifier:
+    """
+    Verifies a suction grasp by polling a vacuum/pressure sensor connected to a Dobot I/O port.
+
+    The I/O stand-in only has to provide `io_adc(address) -> int`, so DobotController and
+    SimulatedVacuumIO can be used interchangeably.
+    """
+
+    def __init__(self,
+                 address: int,
+                 seal_threshold: int,
+                 io: Optional = None,
+                 sealed_below: bool = True,
+                 sealed_samples: int = 2,
+                 min_dwell: float = 0.3,
+                 settle_time: float = 0.1,
+                 settle_tolerance: int = 5,
+                 polling_interval: float = 0.005,
+                 timeout: float = 0.8,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        """
+        :param io: Object that reads the sensor with `io_adc(address)`, e.g. DobotController.
+                   DobotPicker binds itself, so it can be left None for a picker.
+        :param address: I/O port address of the sensor, multiplexed as ADC
+        :param seal_threshold: Sensor value that separates sealed from leaking
+        :param sealed_below: Whether values below the threshold mean sealed (True for a pressure sensor on vacuum)
+        :param sealed_samples: The number of consecutive sealed values to decide the grasp has succeeded
+        :param min_dwell: Seconds before the grasp can be decided to have failed early.
+                          Longer than the delay until the vacuum starts building up, during which values stay ambient.
+        :param settle_time: Seconds of the latest values checked to decide the grasp has failed early
+        :param settle_tolerance: Max spread of the latest values that counts as settled without a seal
+        :param polling_interval: Seconds between sensor reads
+        :param timeout: Seconds until the grasp is decided to have failed
+        :param clock: Monotonic clock in seconds
+        :param sleep: Function that sleeps for the specified seconds
+        """
+
+        self.io = io
+        self.address = address
+        self.seal_threshold = seal_threshold
+        self.sealed_below = sealed_below
+        self.sealed_samples = sealed_samples
+        self.min_dwell = min_dwell
+        self.settle_time = settle_time
+        self.settle_tolerance = settle_tolerance
+        self.polling_interval = polling_interval
+        self.timeout = timeout
+        self.clock = clock
+        self.sleep = sleep
+
+    def is_sealed_value(self, value: int) -> bool:
+        return value < self.seal_threshold if self.sealed_below else value > self.seal_threshold
+
+    def is_sealed(self) -> bool:
+        """
+        Read the sensor once and return whether the suction cup holds a seal, e.g. after lifting an item.
+        """
+
+        return self.is_sealed_value(self.__read())
+
+    def wait_for_seal(self) -> GraspVerification:
+        """
+        Poll the sensor right after the suction cup is turned on.
+
+        Succeeds as soon as `sealed_samples` consecutive values are sealed.
+        Fails as soon as the values of the latest `settle_time` seconds have settled without a seal
+        after `min_dwell` seconds, or on timeout.
+        """
+
+        start = self.clock()
+        values = []
+        elapsed_times = []
+        sealed_count = 0
+        while True:
+            value = self.__read()
+            values.append(value)
+            elapsed = self.clock() - start
+            elapsed_times.append(elapsed)
+
+            sealed_count = sealed_count + 1 if self.is_sealed_value(value) else 0
+            if sealed_count >= self.sealed_samples:
+                return GraspVerification(is_sealed=True, elapsed=elapsed, values=values)
+
+            if elapsed >= self.min_dwell and elapsed >= self.settle_time and sealed_count == 0:
+                latest_values = [latest_value for latest_value, t in zip(values, elapsed_times)
+                                 if t >= elapsed - self.settle_time]
+                if max(latest_values) - min(latest_values) <= self.settle_tolerance:
+                    return GraspVerification(is_sealed=False, elapsed=elapsed, values=values)
+
+            if elapsed >= self.timeout:
+                return GraspVerification(is_sealed=False, elapsed=elapsed, values=values)
+            self.sleep(self.polling_interval)
+
+    def __read(self) -> int:
+        if self.io is None:
+            raise ValueError(f"{self.__class__.__name__} has no I/O to read the sensor. "
+                             f"Pass it to DobotPicker or set 'io'.")
+        return self.io.io_adc(self.address)
+
+
+class SimulatedVacuumIO:
+    """
+    Stand-in for DobotController.io_adc that plays back a vacuum sensor.
+    The value falls linearly from `ambient_value` to `sealed_value` over `evacuation_time` seconds
+    after `seal_delay` seconds, or stays around `ambient_value` if `seals` is False.
+    """
+
+    def __init__(self,
+                 seals: bool,
+                 ambient_value: int = 800,
+                 sealed_value: int = 200,
+                 seal_delay: float = 0.02,
+                 evacuation_time: float = 0.03,
+                 noise: Sequence[int] = (0, 1, -1, 2, -2),
+                 clock: Callable[[], float] = time.monotonic):
+        self.seals = seals
+        self.ambient_value = ambient_value
+        self.sealed_value = sealed_value
+        self.seal_delay = seal_delay
+        self.evacuation_time = evacuation_time
+        self.noise = noise
+        self.clock = clock
+        self.read_count = 0
+        self.start_time = clock()
+
+    def restart(self):
+        """
+        Restart the simulation as if the suction cup has just been turned on.
+        """
+
+        self.start_time = self.clock()
+
+    def io_adc(self, address: int) -> int:
+        noise = self.noise[self.read_count % len(self.noise)]
+        self.read_count += 1
+        elapsed = self.clock() - self.start_time
+        if not self.seals or elapsed < self.seal_delay:
+            return self.ambient_value + noise
+        progress = min((elapsed - self.seal_delay) / self.evacuation_time, 1.0)
+        return int(self.ambient_value + (self.sealed_value - self.ambient_value) * progress) + noise
+
+
+# Usage example
+if __name__ == "__main__":
+    for seals, seal_delay in ((True, 0.02), (True, 0.1), (False, 0.02)):
+        simulated_io = SimulatedVacuumIO(seals=seals, seal_delay=seal_delay)
+        verifier = SuctionGraspVerifier(io=simulated_io, address=1, seal_threshold=400)
+        simulated_io.restart()
+        result = verifier.wait_for_seal()
+        print(f"seals: {seals} (delay {seal_delay*1000:.0f}ms) -> sealed: {result.is_sealed} "
+              f"in {result.elapsed*1000:.1f}ms ({len(result.values)} reads)")
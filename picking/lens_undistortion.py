@@ -0,0 +1,208 @@
+import cv2
+import numpy as np
+from cv2 import aruco
+from enum import Enum
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Sequence, Tuple, Union
+
+
+class UndistortionMode(Enum):
+    IMAGE = "image"  # Remap every captured frame, so that the estimator also sees undistorted items
+    POINTS = "points"  # Undistort only the target points before the coordinate transformation
+
+
+class CameraCalibration(NamedTuple):
+    camera_matrix: np.ndarray  # 3x3 intrinsic matrix
+    distortion_coefficients: np.ndarray  # (k1, k2, p1, p2, k3)
+    image_size: Tuple[int, int]  # (width, height)
+    reprojection_error: float  # RMS reprojection error in pixels
+
+
+def calibrate_camera_from_checkerboard(images: Sequence[np.ndarray],
+                                       pattern_size: Tuple[int, int] = (9, 6),
+                                       square_size: float = 1.0) -> CameraCalibration:
+    """
+    Calibrate the camera intrinsics and the lens distortion from checkerboard images.
+
+    :param images: Images of the checkerboard in various positions and tilts
+    :param pattern_size: The number of inner corners per row and column: (columns, rows)
+    :param square_size: Side of a square. Any unit works because only the intrinsics are used.
+    """
+
+    board_points = np.zeros(shape=(pattern_size[0] * pattern_size[1], 3), dtype=np.float32)
+    board_points[:, :2] = np.mgrid[0:pattern_size[0], 0:pattern_size[1]].T.reshape(-1, 2) * square_size
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001)
+
+    object_points, image_points = [], []
+    for image in images:
+        gray_image = cv2.cvtColor(src=image, code=cv2.COLOR_BGR2GRAY)
+        is_found, corners = cv2.findChessboardCorners(image=gray_image, patternSize=pattern_size)
+        if not is_found:
+            continue
+        corners = cv2.cornerSubPix(image=gray_image, corners=corners, winSize=(11, 11), zeroZone=(-1, -1),
+                                   criteria=criteria)
+        object_points.append(board_points)
+        image_points.append(corners)
+    return __calibrate(object_points=object_points, image_points=image_points, image_shape=images[0].shape)
+
+
+def calibrate_camera_from_charuco(images: Sequence[np.ndarray],
+                                  board_size: Tuple[int, int] = (7, 5),
+                                  square_length: float = 0.04,
+                                  marker_length: float = 0.03,
+                                  dictionary: int = aruco.DICT_6X6_250) -> CameraCalibration:
+    """
+    Calibrate the camera intrinsics and the lens distortion from images of a ChArUco board,
+    a checkerboard with ArUco markers that can be partially out of sight or occluded.
+    Both the aruco API of OpenCV >= 4.7 and the legacy one are supported, like detect_qr.
+
+    :param images: Images of the board in various positions and tilts
+    :param board_size: The number of squares: (columns, rows)
+    :param square_length: Side of a square
+    :param marker_length: Side of a marker in the same unit as `square_length`
+    :param dictionary: ArUco dictionary of the markers. The same one as detect_qr by default.
+    """
+
+    aruco_dictionary = aruco.getPredefinedDictionary(dictionary)
+    if hasattr(aruco, "CharucoDetector"):  # OpenCV >= 4.7
+        board = aruco.CharucoBoard(board_size, square_length, marker_length, aruco_dictionary)
+        board_corners = board.getChessboardCorners()
+        detector = aruco.CharucoDetector(board)
+
+        def detect_board(image: np.ndarray) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+            charuco_corners, charuco_ids, _, _ = detector.detectBoard(image)
+            return charuco_corners, charuco_ids
+    else:
+        board = aruco.CharucoBoard_create(board_size[0], board_size[1], square_length, marker_length, aruco_dictionary)
+        board_corners = board.chessboardCorners
+
+        def detect_board(image: np.ndarray) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+            marker_corners, marker_ids, _ = aruco.detectMarkers(image, aruco_dictionary)
+            if marker_ids is None:
+                return None, None
+            _, charuco_corners, charuco_ids = aruco.interpolateCornersCharuco(marker_corners, marker_ids, image, board)
+            return charuco_corners, charuco_ids
+
+    object_points, image_points = [], []
+    for image in images:
+        charuco_corners, charuco_ids = detect_board(image)
+        if charuco_ids is None or len(charuco_ids) < 6:  # Too few corners to constrain the distortion
+            continue
+        object_points.append(np.asarray(board_corners, dtype=np.float32)[charuco_ids.ravel()].reshape(-1, 1, 3))
+        image_points.append(np.asarray(charuco_corners, dtype=np.float32).reshape(-1, 1, 2))
+    return __calibrate(object_points=object_points, image_points=image_points, image_shape=images[0].shape)
+
+
+def __calibrate(object_points: List[np.ndarray], image_points: List[np.ndarray], image_shape: tuple) -> CameraCalibration:
+    if len(object_points) < 3:
+        raise ValueError(f"The calibration pattern was found in only {len(object_points)} images. At least 3 are needed.")
+    image_size = (image_shape[1], image_shape[0])
+    reprojection_error, camera_matrix, distortion_coefficients, _, _ = cv2.calibrateCamera(
+        objectPoints=object_points, imagePoints=image_points, imageSize=image_size, cameraMatrix=None, distCoeffs=None)
+    return CameraCalibration(camera_matrix=camera_matrix,
+                             distortion_coefficients=distortion_coefficients.ravel(),
+                             image_size=image_size,
+                             reprojection_error=reprojection_error)
+
+
+class LensUndistorter:
+    """
+    Removes the lens distortion with a lookup table precomputed by initUndistortRectifyMap and cached on disk,
+    so that a frame costs one remap and a point costs one undistortPoints call.
+    Undistorted images and points share the same camera matrix, so either can be passed to CoordinateTransformer.
+    """
+
+    def __init__(self, calibration_path: Path):
+        """
+        :param calibration_path: .npz file of the calibration and the lookup table.
+                                 The suffix is replaced with .npz because numpy always saves with it.
+        """
+
+        self.calibration_path = Path(calibration_path).with_suffix('.npz')
+        self.calibration: Optional[CameraCalibration] = None
+        self.__new_camera_matrix: Optional[np.ndarray] = None
+        self.__map1: Optional[np.ndarray] = None
+        self.__map2: Optional[np.ndarray] = None
+        if self.calibration_path.is_file():
+            self.__load()
+        else:
+            print(f"[WARNING] {self.__class__.__name__} has not been calibrated. Please call 'fit' method.")
+
+    @property
+    def is_calibrated(self) -> bool:
+        return self.calibration is not None
+
+    def fit(self, calibration: CameraCalibration):
+        """
+        Build the lookup table for the calibration and save both.
+
+        :param calibration: Result of `calibrate_camera_from_checkerboard` or `calibrate_camera_from_charuco`
+        """
+
+        self.calibration = calibration
+        # alpha=0 keeps only valid pixels, so that no black borders look like edges to the estimator
+        self.__new_camera_matrix, _ = cv2.getOptimalNewCameraMatrix(cameraMatrix=calibration.camera_matrix,
+                                                                    distCoeffs=calibration.distortion_coefficients,
+                                                                    imageSize=calibration.image_size,
+                                                                    alpha=0)
+        # Fixed-point maps are smaller and faster to remap than float maps
+        self.__map1, self.__map2 = cv2.initUndistortRectifyMap(cameraMatrix=calibration.camera_matrix,
+                                                               distCoeffs=calibration.distortion_coefficients,
+                                                               R=None,
+                                                               newCameraMatrix=self.__new_camera_matrix,
+                                                               size=calibration.image_size,
+                                                               m1type=cv2.CV_16SC2)
+        np.savez(file=self.calibration_path,
+                 camera_matrix=calibration.camera_matrix,
+                 distortion_coefficients=calibration.distortion_coefficients,
+                 image_size=np.array(calibration.image_size),
+                 reprojection_error=np.array(calibration.reprojection_error),
+                 new_camera_matrix=self.__new_camera_matrix,
+                 map1=self.__map1,
+                 map2=self.__map2)
+
+    def undistort_image(self, image: np.ndarray) -> np.ndarray:
+        """
+        :param image: Image of the calibrated size
+        :return: Undistorted image of the same size
+        """
+
+        if tuple(image.shape[1::-1]) != self.calibration.image_size:
+            raise ValueError(f"The image size {image.shape[1::-1]} differs from the calibrated size "
+                             f"{self.calibration.image_size}.")
+        return cv2.remap(src=image, map1=self.__map1, map2=self.__map2, interpolation=cv2.INTER_LINEAR)
+
+    def undistort_points(self, points: Union[list, tuple, np.ndarray]) -> np.ndarray:
+        """
+        :param points: Coordinates in a distorted image: [[x1, y1], ..., [xn, yn]]
+        :return: Coordinates in the undistorted image: np.array([[x1, y1], ..., [xn, yn]])
+        """
+
+        distorted_points = np.asarray(points, dtype=np.float64).reshape(-1, 1, 2)
+        undistorted_points = cv2.undistortPoints(src=distorted_points,
+                                                 cameraMatrix=self.calibration.camera_matrix,
+                                                 distCoeffs=self.calibration.distortion_coefficients,
+                                                 P=self.__new_camera_matrix)
+        return undistorted_points.reshape(-1, 2)
+
+    def __load(self):
+        with np.load(file=self.calibration_path) as cache:
+            self.calibration = CameraCalibration(camera_matrix=cache['camera_matrix'],
+                                                 distortion_coefficients=cache['distortion_coefficients'],
+                                                 image_size=tuple(int(value) for value in cache['image_size']),
+                                                 reprojection_error=float(cache['reprojection_error']))
+            self.__new_camera_matrix = cache['new_camera_matrix']
+            self.__map1 = cache['map1']
+            self.__map2 = cache['map2']
+
+
+# Usage example
+if __name__ == "__main__":
+    image_dir_str = input("Enter a path to a directory of checkerboard images.\n>> ")
+    calibration_path_str = input("Enter the lens undistorter's calibration path (.npz).\n>> ")
+    board_images = [cv2.imread(str(path)) for path in sorted(Path(image_dir_str).glob("*.png"))]
+    undistorter = LensUndistorter(calibration_path=Path(calibration_path_str))
+    undistorter.fit(calibrate_camera_from_checkerboard(images=board_images))
+    print(f"Reprojection error: {undistorter.calibration.reprojection_error:.3f}px")
+    cv2.imshow("Undistorted", undistorter.undistort_image(board_images[0]))
+    cv2.waitKey(0)
@@ -0,0 +1,164 @@
+import cv2
+import json
+import time
+import itertools
+import random
+import numpy as np
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+from .pickable_point_estimation import PickablePointEstimationParameters, PickablePointEstimator
+
+
+class ParameterSweepResult(NamedTuple):
+    parameters: PickablePointEstimationParameters
+    accuracy: float  # Rate of images whose target point is judged correctly
+    mean_runtime: float  # Mean seconds to estimate the target point of an image
+    max_runtime: float  # Max seconds to estimate the target point of an image
+
+
+class LabeledBulkImage(NamedTuple):
+    name: str
+    image: np.ndarray
+    pickable_points: np.ndarray  # Labeled pickable points: [[x1, y1], ..., [xn, yn]]. Empty if nothing is pickable.
+
+
+def load_labeled_bulk_images(image_dir: Path, labels_file_name: str = "labels.json") -> List[LabeledBulkImage]:
+    """
+    Load labeled bulk images.
+
+    :param image_dir: Directory holding bulk images and a labels JSON file
+    :param labels_file_name: JSON file that maps image file names to pickable points in the form of
+                             {"image1.png": [[x1, y1], [x2, y2]], "image2.png": [], ...}
+    :return: Labeled bulk images in the order of their names
+    """
+
+    with (image_dir / labels_file_name).open(mode='r') as labels_file:
+        labels: dict = json.load(labels_file)
+
+    labeled_images = []
+    for name in sorted(labels.keys()):
+        image = cv2.imread(filename=str(image_dir / name))
+        if image is None:
+            raise FileNotFoundError(f"Could not read the labeled image {name}.")
+        labeled_images.append(LabeledBulkImage(name=name,
+                                               image=image,
+                                               pickable_points=np.array(labels[name], dtype=float).reshape(-1, 2)))
+    return labeled_images
+
+
+def grid_parameters(grid: Dict[str, Sequence],
+                    base: PickablePointEstimationParameters = PickablePointEstimationParameters()
+                    ) -> List[PickablePointEstimationParameters]:
+    """
+    All the combinations of the specified parameter values.
+
+    :param grid: Candidate values for each parameter name: {"canny_threshold1": [50, 100], "step": [2, 3], ...}
+    :param base: Parameters used for the names not in the grid
+    """
+
+    names = list(grid.keys())
+    return [base._replace(**dict(zip(names, values))) for values in itertools.product(*grid.values())]
+
+
+def random_parameters(space: Dict[str, Sequence],
+                      sample_num: int,
+                      base: PickablePointEstimationParameters = PickablePointEstimationParameters(),
+                      seed: Optional[int] = None) -> List[PickablePointEstimationParameters]:
+    """
+    Random samples of the specified parameter values without duplicates.
+
+    :param space: Candidate values for each parameter name
+    :param sample_num: The max number of samples
+    :param base: Parameters used for the names not in the space
+    :param seed: Seed of the random sampling
+    """
+
+    rng = random.Random(seed)
+    # Duplicated candidates would make the combinations look more than they are and never end the sampling
+    unique_space = {name: [value for index, value in enumerate(values) if value not in values[:index]]
+                    for name, values in space.items()}
+    sampled = []
+    combination_num = int(np.prod([len(values) for values in unique_space.values()]))
+    while len(sampled) < min(sample_num, combination_num):
+        parameters = base._replace(**{name: rng.choice(values) for name, values in unique_space.items()})
+        if parameters not in sampled:
+            sampled.append(parameters)
+    return sampled
+
+
+def evaluate_parameters(parameters: PickablePointEstimationParameters,
+                        labeled_images: Iterable[LabeledBulkImage],
+                        tolerance: float = 10) -> ParameterSweepResult:
+    """
+    Evaluate the estimator with the specified parameters.
+    A target point is correct if it is within `tolerance` pixels from a labeled pickable point.
+    If an image has no labeled pickable points, estimating no target point is correct.
+    """
+
+    estimator = PickablePointEstimator(parameters=parameters)
+    correct_num = 0
+    runtimes = []
+    for labeled_image in labeled_images:
+        start = time.perf_counter()
+        _, target_point = estimator.estimate_target_point(bulk_image=labeled_image.image)
+        runtimes.append(time.perf_counter() - start)
+
+        if target_point is None:
+            correct_num += len(labeled_image.pickable_points) == 0
+        elif len(labeled_image.pickable_points) > 0:
+            distances = np.linalg.norm(labeled_image.pickable_points - target_point, axis=1)
+            correct_num += distances.min() <= tolerance
+
+    return ParameterSweepResult(parameters=parameters,
+                                accuracy=correct_num / len(runtimes) if runtimes else 0.0,
+                                mean_runtime=float(np.mean(runtimes)) if runtimes else 0.0,
+                                max_runtime=max(runtimes, default=0.0))
+
+
+def sweep_parameters(parameters_list: Sequence[PickablePointEstimationParameters],
+                     image_dir: Path,
+                     tolerance: float = 10,
+                     max_workers: Optional[int] = None) -> List[ParameterSweepResult]:
+    """
+    Evaluate parameter sets over labeled bulk images on a process pool.
+
+    :param parameters_list: Parameter sets to evaluate, e.g. from `grid_parameters` or `random_parameters`
+    :param image_dir: Directory for `load_labeled_bulk_images`
+    :param tolerance: Pixels within which a target point is judged correct
+    :param max_workers: The number of worker processes. The number of CPUs is used if None.
+    :return: Results ranked by higher accuracy, then by shorter mean runtime
+    """
+
+    with ProcessPoolExecutor(max_workers=max_workers,
+                             initializer=_load_worker_images,
+                             initargs=(image_dir,)) as executor:
+        results = list(executor.map(_evaluate_on_worker_images, parameters_list, itertools.repeat(tolerance)))
+    return sorted(results, key=lambda result: (-result.accuracy, result.mean_runtime))
+
+
+# Labeled images loaded once per worker process, so that they are not sent with every task
+_worker_images: Tuple[LabeledBulkImage, ...] = ()
+
+
+def _load_worker_images(image_dir: Path):
+    global _worker_images
+    cv2.setNumThreads(1)  # Parallelize over processes, not inside OpenCV
+    _worker_images = tuple(load_labeled_bulk_images(image_dir=image_dir))
+
+
+def _evaluate_on_worker_images(parameters: PickablePointEstimationParameters, tolerance: float) -> ParameterSweepResult:
+    return evaluate_parameters(parameters=parameters, labeled_images=_worker_images, tolerance=tolerance)
+
+
+# Usage example
+if __name__ == "__main__":
+    image_dir_str = input("Enter a path to a directory of labeled bulk images.\n>> ")
+    candidates = grid_parameters({"canny_threshold1": [50, 100, 150],
+                                  "canny_threshold2": [150, 200, 250],
+                                  "sure_foreground_rate": [0.1, 0.2, 0.3],
+                                  "step": [3, 5]})
+    ranking = sweep_parameters(parameters_list=candidates, image_dir=Path(image_dir_str))
+    for rank, result in enumerate(ranking[:10]):
+        print(f"{rank+1}. accuracy: {result.accuracy:.3f}, mean runtime: {result.mean_runtime*1000:.1f}ms, "
+              f"{result.parameters}")
@@ -0,0 +1,231 @@
+import json
+import queue
+import threading
+import numpy as np
+from enum import Enum
+from pathlib import Path
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+from .pickable_point_estimation import PickablePointEstimator, PickablePointEstimatorBackend
+
+
+class PickCycleOutcome(Enum):
+    PICKED = "picked"
+    NO_PICKABLE_ITEMS = "no_pickable_items"
+    GRASP_FAILED = "grasp_failed"
+    ERROR = "error"  # The cycle raised an exception, e.g. from the estimator or a device
+
+
+class PickCycleRecord(NamedTuple):
+    timestamp: float
+    bulk_image: np.ndarray
+    pickable_points: np.ndarray
+    target_point: Optional[np.ndarray]
+    transformed_target_point: Optional[np.ndarray]
+    distance_sensor_values: List[int]
+    outcome: PickCycleOutcome
+    error: Optional[str] = None  # Description of the exception if the outcome is ERROR
+
+
+class PickCycleRecorder:
+    """
+    Records pick cycles into a chunked dataset on a background thread.
+
+    Each chunk is a directory holding `frames.npy`, a memory-mappable array of bulk images,
+    and `cycles.jsonl`, one line of metadata per cycle in the same order.
+    """
+
+    frames_file_name = "frames.npy"
+    cycles_file_name = "cycles.jsonl"
+
+    def __init__(self, dataset_dir: Path, chunk_size: int = 64, max_pending: int = 16):
+        """
+        :param dataset_dir: Directory to write chunks into. Existing chunks are kept.
+        :param chunk_size: The number of cycles per chunk
+        :param max_pending: The number of cycles waiting to be written before new ones are dropped.
+                            This bounds the memory used by the recorder.
+        """
+
+        self.dataset_dir = dataset_dir
+        self.dataset_dir.mkdir(parents=True, exist_ok=True)
+        self.chunk_size = chunk_size
+        self.dropped_count = 0
+        self.failed_count = 0  # The number of cycles that could not be written
+
+        self.__pending = queue.Queue(maxsize=max_pending)
+        # Continue after the last chunk. Counting the chunks would collide with an existing one if there is a gap.
+        self.__chunk_index = max((_chunk_index(chunk_dir) for chunk_dir in _chunk_dirs(self.dataset_dir)),
+                                 default=-1) + 1
+        self.__frames = None
+        self.__cycles_file = None
+        self.__frame_count = 0
+
+        self.__writer = threading.Thread(target=self.__write_loop, daemon=True)
+        self.__writer.start()
+
+    def record(self, record: PickCycleRecord) -> bool:
+        """
+        Queue a cycle to be written without blocking.
+        The recorder keeps a reference to `record.bulk_image`, so do not modify it afterwards.
+
+        :return: False if the cycle was dropped because too many cycles are waiting to be written
+        """
+
+        try:
+            self.__pending.put_nowait(record)
+        except queue.Full:
+            self.dropped_count += 1
+            print(f"[WARNING] {self.__class__.__name__} dropped a cycle (total: {self.dropped_count}).")
+            return False
+        return True
+
+    def close(self):
+        """
+        Write all the queued cycles and stop the background writer.
+        """
+
+        # Do not wait for space in the queue forever if the writer has died
+        while self.__writer.is_alive():
+            try:
+                self.__pending.put(None, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        self.__writer.join()
+
+    def __write_loop(self):
+        while True:
+            record = self.__pending.get()
+            if record is None:
+                break
+            try:
+                self.__write(record)
+            except Exception as error:  # Keep writing the next cycles, e.g. after the disk was full for a while
+                self.failed_count += 1
+                print(f"[WARNING] {self.__class__.__name__} failed to write a cycle "
+                      f"(total: {self.failed_count}): {error}")
+                self.__abandon_chunk()
+        try:
+            self.__close_chunk()
+        except Exception as error:
+            print(f"[WARNING] {self.__class__.__name__} failed to close the last chunk: {error}")
+
+    def __write(self, record: PickCycleRecord):
+        image = record.bulk_image
+        if self.__frames is None or self.__frame_count == self.chunk_size or self.__frames.shape[1:] != image.shape:
+            self.__close_chunk()
+            self.__open_chunk(frame_shape=image.shape, frame_dtype=image.dtype)
+
+        self.__frames[self.__frame_count] = image
+        cycle = {
+            "timestamp": record.timestamp,
+            "pickable_points": np.asarray(record.pickable_points).tolist(),
+            "target_point": None if record.target_point is None else np.asarray(record.target_point).tolist(),
+            "transformed_target_point": None if record.transformed_target_point is None
+                                        else np.asarray(record.transformed_target_point).tolist(),
+            "distance_sensor_values": list(record.distance_sensor_values),
+            "outcome": record.outcome.value,
+            "error": record.error
+        }
+        self.__cycles_file.write(json.dumps(cycle) + "\n")
+        self.__cycles_file.flush()
+        self.__frame_count += 1
+
+    def __open_chunk(self, frame_shape: tuple, frame_dtype: np.dtype):
+        # Take the index first, so that a chunk that failed to open is not retried by the next cycles
+        chunk_dir = self.dataset_dir / f"chunk_{self.__chunk_index:05d}"
+        self.__chunk_index += 1
+        chunk_dir.mkdir()
+        self.__frames = np.lib.format.open_memmap(filename=str(chunk_dir / self.frames_file_name),
+                                                  mode='w+',
+                                                  dtype=frame_dtype,
+                                                  shape=(self.chunk_size, *frame_shape))
+        self.__cycles_file = (chunk_dir / self.cycles_file_name).open(mode='w')
+        self.__frame_count = 0
+
+    def __close_chunk(self):
+        if self.__frames is None:
+            return
+        self.__frames.flush()
+        self.__frames = None
+        self.__cycles_file.close()
+        self.__cycles_file = None
+
+    def __abandon_chunk(self):
+        # Start a new chunk for the next cycle. The cycles already written to this one stay readable.
+        try:
+            self.__close_chunk()
+        except Exception:
+            pass
+        self.__frames = None
+        self.__cycles_file = None
+
+
+def load_pick_cycles(dataset_dir: Path) -> Iterator[PickCycleRecord]:
+    """
+    Load recorded pick cycles in the recorded order.
+    Bulk images are memory-mapped, so they are read from disk only when accessed.
+
+    :param dataset_dir: Directory written by PickCycleRecorder
+    """
+
+    for chunk_dir in _chunk_dirs(dataset_dir):
+        if not (chunk_dir / PickCycleRecorder.frames_file_name).is_file() or \
+                not (chunk_dir / PickCycleRecorder.cycles_file_name).is_file():
+            continue  # The recorder failed to open this chunk
+        frames = np.load(str(chunk_dir / PickCycleRecorder.frames_file_name), mmap_mode='r')
+        with (chunk_dir / PickCycleRecorder.cycles_file_name).open(mode='r') as cycles_file:
+            for index, line in enumerate(cycles_file):
+                cycle = json.loads(line)
+                yield PickCycleRecord(
+                    timestamp=cycle["timestamp"],
+                    bulk_image=frames[index],
+                    pickable_points=np.array(cycle["pickable_points"]),
+                    target_point=None if cycle["target_point"] is None else np.array(cycle["target_point"]),
+                    transformed_target_point=None if cycle["transformed_target_point"] is None
+                                             else np.array(cycle["transformed_target_point"]),
+                    distance_sensor_values=cycle["distance_sensor_values"],
+                    outcome=PickCycleOutcome(cycle["outcome"]),
+                    error=cycle.get("error")  # Missing in datasets recorded before errors were recorded
+                )
+
+
+def replay_pick_cycles(dataset_dir: Path,
+                       estimator: PickablePointEstimatorBackend = None
+                       ) -> Iterator[Tuple[PickCycleRecord, np.ndarray, Optional[np.ndarray]]]:
+    """
+    Run the vision stack against recorded pick cycles back to back.
+
+    :param dataset_dir: Directory written by PickCycleRecorder
+    :param estimator: Estimator to replay. A new PickablePointEstimator is used if not specified.
+    :return: Iterator of (recorded cycle, replayed pickable points, replayed target point or None)
+    """
+
+    estimator = estimator or PickablePointEstimator()
+    for record in load_pick_cycles(dataset_dir):
+        pickable_points, target_point = estimator.estimate_target_point(bulk_image=np.asarray(record.bulk_image))
+        yield record, pickable_points, target_point
+
+
+def _chunk_dirs(dataset_dir: Path) -> List[Path]:
+    return sorted((path for path in dataset_dir.glob("chunk_*") if path.is_dir() and path.name[6:].isdigit()),
+                  key=_chunk_index)
+
+
+def _chunk_index(chunk_dir: Path) -> int:
+    return int(chunk_dir.name[6:])  # chunk_00012 -> 12
+
+
+# Usage example
+if __name__ == "__main__":
+    import time
+    dataset_dir_str = input("Enter a path to a recorded pick cycle dataset.\n>> ")
+    start = time.perf_counter()
+    replayed_num = 0
+    changed_num = 0
+    for recorded, _, replayed_target in replay_pick_cycles(dataset_dir=Path(dataset_dir_str)):
+        replayed_num += 1
+        if (recorded.target_point is None) != (replayed_target is None) or \
+                (replayed_target is not None and not np.array_equal(recorded.target_point, replayed_target)):
+            changed_num += 1
+    elapsed = time.perf_counter() - start
+    print(f"Replayed {replayed_num} cycles in {elapsed:.2f}s ({changed_num} targets changed)")
@@ -1,9 +1,162 @@
 import cv2
 import numpy as np
-from typing import Optional, Union
+from abc import ABC, abstractmethod
+from typing import Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union
 
 
-class PickablePointEstimator:
+class PickablePointEstimationParameters(NamedTuple):
+    hue_lower_limit: int = 30  # Lower limit of the item hue
+    hue_upper_limit: int = 120  # Upper limit of the item hue
+    canny_threshold1: float = 100  # Lower hysteresis threshold of Canny edge detection
+    canny_threshold2: float = 200  # Upper hysteresis threshold of Canny edge detection
+    sure_foreground_rate: float = 0.2  # Rate to the max distance transform value to extract sure foreground
+    picker_size: int = 30  # Size of the picker in pixels
+    search_rate: int = 3  # Rate of the search area size to the picker size
+    step: int = 3  # Step of the sliding picker window in pixels
+    max_edge_pixels: int = 10  # The max number of edge pixels allowed under the picker
+
+
+class PickablePointEstimatorBackend(ABC):
+    """
+    Interface of the estimators that DobotPicker can use to find a point to pick up.
+    """
+
+    @abstractmethod
+    def estimate_pickable_points(self, bulk_image: np.ndarray, show_result: bool = False) -> np.ndarray:
+        """
+        Estimate pickable points in a bulk image.
+
+        :param bulk_image: Image of items in bulk
+        :param show_result: Whether to display the estimation result
+        :return: Pickable point coordinates in descending order of priority: np.array([[x1, y1], ..., [xn, yn]])
+        """
+        pass
+
+    @abstractmethod
+    def iterate_target_points(self,
+                              bulk_image: np.ndarray,
+                              pickable_points: np.ndarray,
+                              show_result: bool = False) -> Iterator[np.ndarray]:
+        """
+        Lazily yield the points to pick up in the order to try them.
+
+        :param bulk_image: Image of items in bulk
+        :param pickable_points: Result of `estimate_pickable_points`
+        :param show_result: Whether to display each target point
+        :return: Iterator of target coordinates: np.array([x, y])
+        """
+        pass
+
+    def estimate_target_point(self,
+                              bulk_image: np.ndarray,
+                              show_result: bool = False) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """
+        Estimate pickable points and the first point to pick up.
+
+        :param bulk_image: Image of items in bulk
+        :param show_result: Whether to display the estimation result
+        :return: Pickable point coordinates: np.array([[x1, y1], ..., [xn, yn]]) and
+                 the target coordinate: np.array([x, y]) or None if there is no pickable point
+        """
+
+        pickable_points = self.estimate_pickable_points(bulk_image=bulk_image, show_result=show_result)
+        target_points = self.iterate_target_points(bulk_image=bulk_image,
+                                                   pickable_points=pickable_points,
+                                                   show_result=show_result)
+        return pickable_points, next(target_points, None)
+
+    def estimate_target_points(self,
+                               bulk_images: Sequence[np.ndarray]) -> List[Tuple[np.ndarray, Optional[np.ndarray]]]:
+        """
+        Batched `estimate_target_point` over multiple frames or crops.
+        Backends that can process a batch at once override this.
+        """
+
+        return [self.estimate_target_point(bulk_image=bulk_image) for bulk_image in bulk_images]
+
+
+class PickablePointEstimationWorkspace:
+    """
+    Buffers reused by PickablePointEstimator for every frame of one size,
+    so that the steady-state estimation writes into them instead of allocating new images.
+    """
+
+    kernel = np.ones(shape=(3, 3), dtype=np.uint8)  # 3x3 kernel of the morphological operations
+
+    def __init__(self, frame_shape: Tuple[int, ...], search_size: int):
+        """
+        :param frame_shape: Shape of the bulk images: (height, width) or (height, width, channels)
+        :param search_size: Side of the search area cropped to adjust an estimated point
+        """
+
+        height, width = frame_shape[:2]
+        self.frame_shape = (height, width)
+        self.search_size = search_size
+
+        # Buffers of the whole frame
+        self.hsv = np.empty(shape=(height, width, 3), dtype=np.uint8)
+        self.mask = np.empty(shape=(height, width), dtype=np.uint8)
+        self.gray = np.empty(shape=(height, width), dtype=np.uint8)
+        self.edges = np.empty(shape=(height, width), dtype=np.uint8)
+        self.inverted = np.empty(shape=(height, width), dtype=np.uint8)
+        self.eroded = np.empty(shape=(height, width), dtype=np.uint8)
+        self.closed = np.empty(shape=(height, width), dtype=np.uint8)
+        self.masked = np.empty(shape=(height, width), dtype=np.uint8)
+        self.opened = np.empty(shape=(height, width), dtype=np.uint8)
+        self.distance = np.empty(shape=(height, width), dtype=np.float32)
+        self.sure_foreground = np.empty(shape=(height, width), dtype=np.uint8)
+        self.labels = np.empty(shape=(height, width), dtype=np.int32)
+        self.plot = np.empty(shape=(height, width, 3), dtype=np.uint8)
+
+        # Buffers of the search area. Crops clipped at the image borders are smaller and do not use them.
+        self.search_gray = np.empty(shape=(search_size, search_size), dtype=np.uint8)
+        self.search_edges = np.empty(shape=(search_size, search_size), dtype=np.uint8)
+        self.search_hsv = np.empty(shape=(search_size, search_size, 3), dtype=np.uint8)
+        self.search_mask = np.empty(shape=(search_size, search_size), dtype=np.uint8)
+
+    def fits(self, frame_shape: Tuple[int, ...], search_size: int) -> bool:
+        return self.frame_shape == tuple(frame_shape[:2]) and self.search_size == search_size
+
+    def search_buffers(self, search_image: np.ndarray) -> Tuple[Optional[np.ndarray], ...]:
+        """
+        Buffers for the gray, edge, HSV and mask images of a search crop, or None for each if the crop does not fit.
+        """
+
+        if search_image.shape[:2] != (self.search_size, self.search_size):
+            return None, None, None, None
+        return self.search_gray, self.search_edges, self.search_hsv, self.search_mask
+
+
+class PickablePointEstimator(PickablePointEstimatorBackend):
+
+    def __init__(self, parameters: PickablePointEstimationParameters = PickablePointEstimationParameters()):
+        self.parameters = parameters
+        self.__workspace: Optional[PickablePointEstimationWorkspace] = None
+
+    def workspace(self, frame_shape: Tuple[int, ...]) -> PickablePointEstimationWorkspace:
+        """
+        Workspace for bulk images of the specified shape. It is rebuilt only when the frame size changes.
+        """
+
+        search_size = self.parameters.picker_size*self.parameters.search_rate//2*2
+        if self.__workspace is None or not self.__workspace.fits(frame_shape=frame_shape, search_size=search_size):
+            self.__workspace = PickablePointEstimationWorkspace(frame_shape=frame_shape, search_size=search_size)
+        return self.__workspace
+
+    def iterate_target_points(self,
+                              bulk_image: np.ndarray,
+                              pickable_points: np.ndarray,
+                              show_result: bool = False) -> Iterator[np.ndarray]:
+        """
+        Adjust the estimated points in order and yield the pickable ones.
+        """
+
+        for estimated_point in pickable_points:
+            adjusted_point = self.adjust_estimated_point(bulk_image=bulk_image,
+                                                         coordinate=estimated_point,
+                                                         show_result=show_result)
+            if adjusted_point is not None:
+                yield adjusted_point
 
     def estimate_pickable_points(self, bulk_image: np.ndarray, show_result: bool = False) -> np.ndarray:
         """
@@ -14,52 +167,67 @@ class PickablePointEstimator:
         :return: Pickable point coordinates: np.array([[x1, y1], [x2, y2], ..., [xn, yn]])
         """
 
+        workspace = self.workspace(frame_shape=bulk_image.shape)
+
         # Convert the color to HSV
-        hsv_image = cv2.cvtColor(src=bulk_image, code=cv2.COLOR_BGR2HSV)
+        hsv_image = cv2.cvtColor(src=bulk_image, code=cv2.COLOR_BGR2HSV, dst=workspace.hsv)
 
         # Mask pixels that do not have the specified hue
-        mask = self.__mask(source_image=hsv_image, hue_lower_limit=30, hue_upper_limit=120)
+        mask = self.__mask(source_image=hsv_image,
+                           hue_lower_limit=self.parameters.hue_lower_limit,
+                           hue_upper_limit=self.parameters.hue_upper_limit,
+                           dst=workspace.mask)
 
         # Execute canny components
-        coordinates = self.__canny_components(source_image=bulk_image, mask=mask)
+        coordinates = self.__canny_components(source_image=bulk_image, mask=mask, workspace=workspace)
 
         if show_result:
-            plot_image = self.__plot_image(source_image=bulk_image, coordinates=coordinates, max_num=10)
+            plot_image = self.__plot_image(source_image=bulk_image, coordinates=coordinates, max_num=10,
+                                           dst=workspace.plot)
             cv2.imshow('result', plot_image)
             cv2.waitKey(0)
 
         return coordinates
 
-    def __canny_components(self, source_image: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    def __canny_components(self,
+                           source_image: np.ndarray,
+                           mask: np.ndarray,
+                           workspace: PickablePointEstimationWorkspace) -> np.ndarray:
+        kernel = workspace.kernel
+
         # Canny edge detection
-        processing_image = cv2.Canny(image=cv2.cvtColor(src=source_image, code=cv2.COLOR_BGR2GRAY),
-                                     threshold1=100,
-                                     threshold2=200,
-                                     edges=3,
+        processing_image = cv2.Canny(image=cv2.cvtColor(src=source_image, code=cv2.COLOR_BGR2GRAY, dst=workspace.gray),
+                                     threshold1=self.parameters.canny_threshold1,
+                                     threshold2=self.parameters.canny_threshold2,
+                                     edges=workspace.edges,
+                                     apertureSize=3,
                                      L2gradient=False)
 
         # Color inversion
-        processing_image = cv2.bitwise_not(src=processing_image)
-
-        # 3x3 kernel
-        kernel = np.ones(shape=(3, 3), dtype=np.uint8)
+        processing_image = cv2.bitwise_not(src=processing_image, dst=workspace.inverted)
 
         # Morphological operations
-        processing_image = cv2.erode(src=processing_image, kernel=kernel, iterations=1)
-        processing_image = cv2.morphologyEx(src=processing_image, op=cv2.MORPH_CLOSE, kernel=kernel, iterations=1)
-        processing_image = cv2.morphologyEx(src=processing_image, op=cv2.MORPH_CLOSE, kernel=kernel, iterations=1)
-        processing_image = cv2.bitwise_and(src1=processing_image, src2=processing_image, mask=mask)  # mask
-        processing_image = cv2.morphologyEx(processing_image, cv2.MORPH_OPEN, kernel, iterations=2)
+        processing_image = cv2.erode(src=processing_image, kernel=kernel, dst=workspace.eroded, iterations=1)
+        processing_image = cv2.morphologyEx(src=processing_image, op=cv2.MORPH_CLOSE, kernel=kernel,
+                                            dst=workspace.closed, iterations=1)
+        processing_image = cv2.morphologyEx(src=processing_image, op=cv2.MORPH_CLOSE, kernel=kernel,
+                                            dst=workspace.eroded, iterations=1)
+        # mask (the mask is 0 or 255, so AND with it leaves no stale pixels in the reused buffer)
+        processing_image = cv2.bitwise_and(src1=processing_image, src2=mask, dst=workspace.masked)
+        processing_image = cv2.morphologyEx(src=processing_image, op=cv2.MORPH_OPEN, kernel=kernel,
+                                            dst=workspace.opened, iterations=2)
 
         # Distance transformation
-        dist_transform = cv2.distanceTransform(src=processing_image, distanceType=cv2.DIST_L2, maskSize=3)
+        dist_transform = cv2.distanceTransform(src=processing_image, distanceType=cv2.DIST_L2, maskSize=3,
+                                               dst=workspace.distance)
 
-        # Extract sure foreground area
-        _, sure_fg = cv2.threshold(src=dist_transform, thresh=0.2 * dist_transform.max(), maxval=255, type=0)
-        sure_fg = np.uint8(sure_fg)
+        # Extract sure foreground area: 255 where the distance is over the threshold
+        _, max_distance, _, _ = cv2.minMaxLoc(src=dist_transform)
+        sure_fg = cv2.compare(src1=dist_transform, src2=self.parameters.sure_foreground_rate * max_distance,
+                              cmpop=cv2.CMP_GT, dst=workspace.sure_foreground)
 
         # Label (Number) for each 1 object in foreground
-        _, _, stats, centroids = cv2.connectedComponentsWithStats(sure_fg)
+        _, _, stats, centroids = cv2.connectedComponentsWithStats(image=sure_fg, labels=workspace.labels)
 
         stats_areas_pair = np.insert(arr=stats[1:], obj=[5], values=centroids[1:], axis=1)
 
@@ -67,57 +235,98 @@ class PickablePointEstimator:
 
         return sorted_stats_area[:, 5:7]  # Array of barycentric coordinates
 
-    def __mask(self, source_image: np.ndarray, hue_lower_limit: int, hue_upper_limit: int) -> np.ndarray:
-        bgr_lower = np.array([hue_lower_limit, 0, 0])  # Lower limit of color to mask
-        bgr_upper = np.array([hue_upper_limit, 255, 255])  # Upper limit of color to mask
-        mask = cv2.inRange(src=source_image, lowerb=bgr_lower, upperb=bgr_upper)  # Generate the mask image
+    def __mask(self,
+               source_image: np.ndarray,
+               hue_lower_limit: int,
+               hue_upper_limit: int,
+               dst: Optional[np.ndarray] = None) -> np.ndarray:
+        bgr_lower = (hue_lower_limit, 0, 0)  # Lower limit of color to mask
+        bgr_upper = (hue_upper_limit, 255, 255)  # Upper limit of color to mask
+        mask = cv2.inRange(src=source_image, lowerb=bgr_lower, upperb=bgr_upper, dst=dst)  # Generate the mask image
         return mask
 
     def adjust_estimated_point(self,
                                bulk_image: np.ndarray,
                                coordinate: np.ndarray,
-                               picker_size: int = 20,
-                               search_rate: int = 3,
-                               step: int = 3,
+                               picker_size: Optional[int] = None,
+                               search_rate: Optional[int] = None,
+                               step: Optional[int] = None,
                                show_result: bool = False) -> Optional[np.ndarray]:
         """
         Adjust an estimated point.
 
         :param bulk_image: Image of items in bulk
         :param coordinate: Estimated pickable point in bulk_image: np.array([x, y])
+        :param picker_size: Overrides `parameters.picker_size`
+        :param search_rate: Overrides `parameters.search_rate`
+        :param step: Overrides `parameters.step`
         :param show_result: Whether to display the estimation result
         :return: Adjusted coordinate: np.array([x, y]) or None if there is no pickable point
         """
 
-        # Crop image for search
-        search_image = bulk_image[coordinate[1]-picker_size*search_rate//2:coordinate[1]+picker_size*search_rate//2,
-                                  coordinate[0]-picker_size*search_rate//2:coordinate[0]+picker_size*search_rate//2]
+        picker_size = picker_size or self.parameters.picker_size
+        search_rate = search_rate or self.parameters.search_rate
+        step = step or self.parameters.step
+
+        # Crop image for search (clipped at the image borders)
+        half_search_size = picker_size*search_rate//2
+        top = max(coordinate[1]-half_search_size, 0)
+        left = max(coordinate[0]-half_search_size, 0)
+        search_image = bulk_image[top:coordinate[1]+half_search_size, left:coordinate[0]+half_search_size]
+        if min(search_image.shape[:2]) < picker_size:
+            return None
+        picker_offset = half_search_size - (2*half_search_size-picker_size)//2  # From the window corner to its center
+
+        # Buffers are reused only with the default search area of a whole crop
+        if (picker_size, search_rate) == (self.parameters.picker_size, self.parameters.search_rate):
+            workspace = self.workspace(frame_shape=bulk_image.shape)
+            gray_buffer, edges_buffer, hsv_buffer, mask_buffer = workspace.search_buffers(search_image=search_image)
+            plot_buffer = workspace.plot
+        else:
+            gray_buffer = edges_buffer = hsv_buffer = mask_buffer = plot_buffer = None
 
         # Canny edge detection
-        canny_image = cv2.Canny(cv2.cvtColor(search_image, cv2.COLOR_BGR2GRAY), 100, 200, 3, L2gradient=False)
+        canny_image = cv2.Canny(cv2.cvtColor(search_image, cv2.COLOR_BGR2GRAY, dst=gray_buffer),
+                                self.parameters.canny_threshold1,
+                                self.parameters.canny_threshold2,
+                                edges=edges_buffer,
+                                apertureSize=3,
+                                L2gradient=False)
 
         # Mask pixels that do not have the specified hue
-        hsv_image = cv2.cvtColor(search_image, cv2.COLOR_BGR2HSV)
-        mask = cv2.bitwise_not(self.__mask(source_image=hsv_image, hue_lower_limit=30, hue_upper_limit=120))
-        canny_image = cv2.bitwise_or(canny_image, mask)
-        
-        # Search crop image for pickable point
+        hsv_image = cv2.cvtColor(search_image, cv2.COLOR_BGR2HSV, dst=hsv_buffer)
+        mask = self.__mask(source_image=hsv_image,
+                           hue_lower_limit=self.parameters.hue_lower_limit,
+                           hue_upper_limit=self.parameters.hue_upper_limit,
+                           dst=mask_buffer)
+        mask = cv2.bitwise_not(mask, dst=mask)
+        canny_image = cv2.bitwise_or(canny_image, mask, dst=canny_image)
+
+        # Search crop image for pickable point (edge and masked pixels are 255, the others are 0)
         for i in range(0, canny_image.shape[0]-picker_size+1, step):
             for j in range(0, canny_image.shape[1]-picker_size+1, step):
                 rect = canny_image[i:picker_size+i+1, j:picker_size+j+1]
-                if np.count_nonzero(rect > 0) <= 10:
-                    new_coordinate = coordinate + np.array([j-(canny_image.shape[1]-picker_size)//2,
-                                                            i-(canny_image.shape[0]-picker_size)//2])
+                if np.count_nonzero(rect) <= self.parameters.max_edge_pixels:
+                    new_coordinate = np.array([left+j+picker_offset, top+i+picker_offset])
                     if show_result:
-                        plot_image = self.__plot_image(source_image=bulk_image, coordinates=[new_coordinate], max_num=1)
+                        plot_image = self.__plot_image(source_image=bulk_image, coordinates=[new_coordinate], max_num=1,
+                                                       dst=plot_buffer)
                         cv2.imshow('result', plot_image)
                         cv2.waitKey(0)
                     return new_coordinate
         return None
 
-    def __plot_image(self, source_image: np.ndarray, coordinates: Union[list, tuple, np.ndarray], max_num: int) -> np.ndarray:
+    def __plot_image(self,
+                     source_image: np.ndarray,
+                     coordinates: Union[list, tuple, np.ndarray],
+                     max_num: int,
+                     dst: Optional[np.ndarray] = None) -> np.ndarray:
         num = min(len(coordinates), max_num)
-        plot_image = np.copy(source_image)
+        if dst is None or dst.shape != source_image.shape:
+            plot_image = np.copy(source_image)
+        else:
+            plot_image = dst
+            np.copyto(dst=plot_image, src=source_image)
         for i in range(num):
             coordinate = coordinates[i]
             plot_image = cv2.putText(plot_image,
@@ -143,4 +352,5 @@ if __name__ == '__main__':
     index = int(input("Enter an index of the position to be adjusted in the estimated positions.\n>> "))
     pickable_point_estimator.adjust_estimated_point(bulk_image=image,
                                                     coordinate=estimated_points[index-1],
+                                                    picker_size=20,
                                                     show_result=True)
@@ -1,14 +1,22 @@
 import cv2
 import numpy as np
+from itertools import islice
 from statistics import median
-from typing import Tuple
-from . import distance_sensor
+from typing import Iterator, List, Optional, Tuple
+from .conveyor_tracking import ConveyorTracker, ConveyorTrackingReport, ConveyorVelocityEstimator, InterceptPlanner
 from .coordinate_transformation import CoordinateTransformer
-from .pickable_point_estimation import PickablePointEstimator
+from .distance_sensor import DistanceSensor
+from .grasp_verification import SuctionGraspVerifier
+from .lens_undistortion import LensUndistorter, UndistortionMode, calibrate_camera_from_charuco
+from .pick_cycle_recording import PickCycleOutcome, PickCycleRecord, PickCycleRecorder
+from .pickable_point_estimation import PickablePointEstimator, PickablePointEstimatorBackend
 from .qr_detector import detect_qr
+from .reconnecting_capture import ReconnectingCapture
 from ..carrying.carrier import DobotCarrier
+from ..carrying.motion_planning import MotionPlanner
+from ..device_registry import DeviceIdentity, DeviceRegistry, serial_port_devices, uvc_camera_devices
 from ..pyuvc import uvc
-from ..util import DobotPosition
+from ..util import DobotIOFunction, DobotPosition
 
 
 class DobotPickingError(Exception):
@@ -22,23 +30,115 @@ class DobotPicker(DobotCarrier):
                  coordinate_transformer: CoordinateTransformer,
                  distance_sensor_displacement: Tuple[float, float, float],
                  port_name: str = "",
-                 home: DobotPosition = DobotCarrier.default_home):
+                 home: DobotPosition = DobotCarrier.default_home,
+                 pick_cycle_recorder: Optional[PickCycleRecorder] = None,
+                 pickable_point_estimator: Optional[PickablePointEstimatorBackend] = None,
+                 grasp_verifier: Optional[SuctionGraspVerifier] = None,
+                 dobot_identity: Optional[DeviceIdentity] = None,
+                 device_registry: Optional[DeviceRegistry] = None,
+                 lens_undistorter: Optional[LensUndistorter] = None,
+                 undistortion_mode: UndistortionMode = UndistortionMode.POINTS,
+                 motion_planner: Optional[MotionPlanner] = None):
         """
         :param bulk_camera_pid: Index of the camera that captures a bulk
         :param coordinate_transformer: Converter that transforms coordinates between the bulk camera image and Dobot
         :param distance_sensor_displacement: Position displacement (x, y, z) of the distance sensor with respect to the suction cup
         :param port_name:
         :param home:
+        :param pick_cycle_recorder: Recorder that keeps every pick cycle for offline replay. Nothing is recorded if None.
+        :param pickable_point_estimator: Estimator backend, e.g. from `create_pickable_point_estimator`.
+                                         The classical PickablePointEstimator with default parameters is used if None.
+        :param grasp_verifier: Verifier that polls the vacuum sensor after turning on the suction cup.
+                               Its sensor is read through this picker, which owns the serial port of Dobot.
+                               Dobot waits a fixed time and assumes a successful grasp if None.
+        :param dobot_identity: USB identity of Dobot to look up its port instead of `port_name`
+        :param device_registry: Registry of serial ports and UVC cameras shared by the camera, the distance sensor and
+                                Dobot. It is watched for hot-plug changes while the picker is activated.
+                                A new registry is created if None.
+        :param lens_undistorter: Undistorter calibrated for the bulk camera. Coordinates are used as distorted if None.
+        :param undistortion_mode: Whether to remap every bulk image or only the target points.
+                                  Remapping images costs a few milliseconds per frame but lets the estimator see
+                                  undistorted items. The coordinate transformer must be calibrated in the same mode.
+        :param motion_planner: Planner that approaches and retreats at the lowest heights clearing the bin walls and
+                               the release station. Dobot approaches at z=-25 and retreats to z=85 if None.
         """
 
-        super().__init__(port_name=port_name, home=home)
+        device_registry = device_registry or DeviceRegistry(enumerators=(serial_port_devices, uvc_camera_devices))
+        super().__init__(port_name=port_name,
+                         home=home,
+                         device_identity=dobot_identity,
+                         device_registry=device_registry)
 
-        devices = uvc.device_list()
-        bulk_device = next(device for device in devices if device['idProduct'] == bulk_camera_pid)
-        self.bulk_capture = uvc.Capture(bulk_device['uid'])
+        self.bulk_capture = ReconnectingCapture(device_registry=device_registry,
+                                                identity=DeviceIdentity(product_id=bulk_camera_pid),
+                                                configure=self.__configure_bulk_camera)
+        self.distance_sensor = DistanceSensor(device_registry=device_registry)
+
+        # Time when the last waited move completed, on the clock of the bulk camera frame timestamps
+        self.motion_end_time = uvc.get_time_monotonic()
+        # Seconds from the exposure of the last analyzed bulk frame to the decision of the target point
+        self.capture_to_decision_latency = None
 
         self.distance_sensor_displacement = distance_sensor_displacement
         self.coordinate_transformer = coordinate_transformer
+        self.pick_cycle_recorder = pick_cycle_recorder
+        self.pickable_point_estimator = pickable_point_estimator or PickablePointEstimator()
+        self.grasp_verifier = grasp_verifier
+        if grasp_verifier is not None:
+            grasp_verifier.io = self
+        self.lens_undistorter = lens_undistorter
+        self.undistortion_mode = undistortion_mode
+        self.motion_planner = motion_planner
+        self.conveyor_velocity_estimator = ConveyorVelocityEstimator()
+
+    def activate(self):
+        super().activate()
+        if self.grasp_verifier is not None:
+            self.set_io_multiplexing(address=self.grasp_verifier.address, multiplex=DobotIOFunction.ADC)
+        self.device_registry.start_watching()
+
+    def deactivate(self):
+        self.device_registry.stop_watching()
+        super().deactivate()
+
+    def move(self, destination: DobotPosition, ptp_mode=DobotCarrier.default_ptp_mode, wait: bool = True):
+        super().move(destination=destination, ptp_mode=ptp_mode, wait=wait)
+        if wait:
+            self.motion_end_time = uvc.get_time_monotonic()
+
+    def capture_after(self, t: float, timeout: float = 1.0, margin: Optional[float] = None) -> Tuple[np.ndarray, float]:
+        """
+        Capture the first bulk image exposed at or after the specified time.
+
+        :param t: Time on the `uvc.get_time_monotonic` clock, e.g. `motion_end_time`
+        :param timeout: Seconds to wait for such a frame
+        :param margin: Seconds from the start of an exposure to the frame timestamp.
+                       The exposure time plus one frame interval of the camera if None.
+        :return: Bulk image and its capture timestamp
+        """
+
+        frame = self.bulk_capture.get_frame_after(t, timeout=timeout, margin=margin)
+        image = self.__undistort_image(cv2.flip(frame.img, 1))
+        return image, frame.timestamp
+
+    def calibrate_lens(self, frame_num: int = 15, board_size: Tuple[int, int] = (7, 5)):
+        """
+        Calibrate the lens undistorter with ChArUco board images. Calibrate the coordinate transformer again after this.
+
+        :param frame_num: The number of board images to capture
+        :param board_size: The number of squares of the board: (columns, rows)
+        """
+
+        if self.lens_undistorter is None:
+            raise ValueError("The picker has no lens undistorter to calibrate.")
+
+        board_images = []
+        for i in range(frame_num):
+            input(f"Place the ChArUco board in a different position or tilt ({i+1}/{frame_num}) and press Enter. >> ")
+            board_images.append(self.__capture_bulk(undistorts=False))
+        calibration = calibrate_camera_from_charuco(images=board_images, board_size=board_size)
+        self.lens_undistorter.fit(calibration=calibration)
+        print(f"Lens undistorter has been calibrated. Reprojection error: {calibration.reprojection_error:.3f}px")
 
     def calibrate_coordinate_transformer(self):
         input("Place QR codes and press Enter. >> ")
@@ -56,71 +156,271 @@ class DobotPicker(DobotCarrier):
             current_position = self.current_position
             dobot_positions.append((current_position.x, current_position.y))
 
-        self.coordinate_transformer.fit(transforming_coordinate_samples=list(qr_centers.values()),
+        qr_center_coordinates = self.__undistort_points(list(qr_centers.values()))
+        self.coordinate_transformer.fit(transforming_coordinate_samples=qr_center_coordinates,
                                         target_coordinate_samples=dobot_positions)
         print("Coordinate transformer has been calibrated.")
 
-    def pick_from_bulk(self, distance_error: float, show_pickable_points: bool = False):
+    def pick_from_bulk(self,
+                       distance_error: float,
+                       show_pickable_points: bool = False,
+                       max_attempts: int = 3,
+                       release_position: Optional[DobotPosition] = None):
         """
         Pick up an item in bulk automatically.
-        Raise DobotPickingError if there is no pickable items.
+        If the grasp verifier detects a failed grasp, Dobot retries the next candidate point.
+        Raise DobotPickingError if there is no pickable items or all the attempts failed.
+
+        :param max_attempts: The max number of candidate points to try
+        :param release_position: Position to carry the picked item to. With the motion planner, Dobot lifts the item
+                                 and traverses there in combined moves. Dobot stays above the item if None.
         """
 
-        # Find a pickable point
-        bulk_image = self.__capture_bulk()
-        pickable_points_estimator = PickablePointEstimator()
-        pickable_points = pickable_points_estimator.estimate_pickable_points(bulk_image=bulk_image,
-                                                                             show_result=show_pickable_points)
-        target_point = None
-        for estimated_point in pickable_points:
-            adjusted_point = pickable_points_estimator.adjust_estimated_point(bulk_image=bulk_image,
-                                                                              coordinate=estimated_point,
-                                                                              picker_size=30,
-                                                                              show_result=show_pickable_points)
-            if adjusted_point is not None:
-                target_point = adjusted_point
-                break
-        if target_point is None:
+        # Find pickable points in the first image taken after the arm stopped
+        bulk_image, captured_at = self.capture_after(self.motion_end_time)
+        try:
+            pickable_points = self.pickable_point_estimator.estimate_pickable_points(bulk_image=bulk_image,
+                                                                                     show_result=show_pickable_points)
+        except Exception as error:
+            self.__record_cycle(timestamp=captured_at,
+                                bulk_image=bulk_image,
+                                pickable_points=np.empty(shape=(0, 2)),
+                                outcome=PickCycleOutcome.ERROR,
+                                error=error)
+            raise
+
+        def target_points() -> Iterator[np.ndarray]:
+            # Errors while adjusting the candidates are recorded here. Those of the attempts are recorded by __pick_at.
+            try:
+                yield from self.pickable_point_estimator.iterate_target_points(bulk_image=bulk_image,
+                                                                               pickable_points=pickable_points,
+                                                                               show_result=show_pickable_points)
+            except Exception as error:
+                self.__record_cycle(timestamp=captured_at,
+                                    bulk_image=bulk_image,
+                                    pickable_points=pickable_points,
+                                    outcome=PickCycleOutcome.ERROR,
+                                    error=error)
+                raise
+
+        attempt_num = 0
+        for target_point in islice(target_points(), max_attempts):
+            if attempt_num == 0:
+                self.capture_to_decision_latency = uvc.get_time_monotonic() - captured_at
+                print(f"Capture-to-decision latency: {self.capture_to_decision_latency * 1000:.1f}ms")
+            attempt_num += 1
+
+            is_picked = self.__pick_at(bulk_image=bulk_image,
+                                       captured_at=captured_at,
+                                       pickable_points=pickable_points,
+                                       target_point=target_point,
+                                       distance_error=distance_error,
+                                       release_position=release_position)
+            if is_picked:
+                return
+            print(f"Failed to grasp at {target_point} (attempt {attempt_num}/{max_attempts})")
+
+        if attempt_num == 0:
+            self.__record_cycle(timestamp=captured_at,
+                                bulk_image=bulk_image,
+                                pickable_points=pickable_points,
+                                outcome=PickCycleOutcome.NO_PICKABLE_ITEMS)
             raise DobotPickingError("There are no pickable items.")
+        raise DobotPickingError(f"Failed to grasp an item in {attempt_num} attempts.")
+
+    def pick_from_conveyor(self,
+                           release_position: DobotPosition,
+                           max_picks: int,
+                           max_cycles: int,
+                           planner: Optional[InterceptPlanner] = None) -> ConveyorTrackingReport:
+        """
+        Pick up items from the running conveyor by intercepting their predicted positions.
+        The conveyor velocity is estimated from the bulk camera frames, so the conveyor keeps running.
+        Raise DobotPickingError if the picker has no grasp verifier.
 
-        # Transform the coordinate
-        transformed_target_point = self.coordinate_transformer.predict(transforming_coordinate=target_point)
-        above_target = DobotPosition(x=transformed_target_point[0],
-                                     y=transformed_target_point[1],
-                                     z=-25,
-                                     r_head=0)
-
-        # Measure the distance
-        measuring_distance_position = self.__measuring_distance_position(above_target=above_target)
-        self.move(destination=measuring_distance_position, wait=True)
-        self.wait(seconds=0.5)
-        distance_sensor_values = distance_sensor.acquire_distance(times=60)
-        distance_sensor_values = (val for val in distance_sensor_values if val < 130)  # Remove the obvious outliers
-        distance_sensor_value = median(distance_sensor_values)
-        distance = distance_sensor_value + distance_error - self.distance_sensor_displacement[2]
-        print(f"Distance: {distance}mm (sensor value: {distance_sensor_value}mm)")
-        target_position = above_target._replace(z=above_target.z-distance)
-
-        # Go to pick up
-        self.move(destination=above_target, wait=False)
-        self.move(destination=target_position, wait=False)
-        self.set_suction_cup(is_on=True)
-        self.wait(seconds=0.8)
-        above_target = above_target._replace(z=85)
-        self.move(destination=above_target)
-
-    def __capture_bulk(self) -> np.ndarray:
-        self.bulk_capture.frame_mode = (640, 480, 30)
-        controls = {control.display_name: control for control in self.bulk_capture.controls}
+        :param release_position: Position to release picked items
+        :param max_picks: The number of items to pick
+        :param max_cycles: The max number of observations
+        :param planner: Interception planner with the timing model of this Dobot. The default one is used if None.
+        :return: Throughput and miss rate of this run
+        """
+
+        # Without the sensor every attempt would count as a pick and the miss rate would always be 0
+        if self.grasp_verifier is None:
+            raise DobotPickingError("Conveyor tracking needs a grasp verifier to tell picks from misses.")
+
+        def capture() -> Tuple[np.ndarray, float]:
+            return self.capture_after(self.motion_end_time)
+
+        tracker = ConveyorTracker(arm=self,
+                                  capture=capture,
+                                  estimator=self.pickable_point_estimator,
+                                  transform=self.__transform,
+                                  wait_for_seal=lambda: self.grasp_verifier.wait_for_seal().is_sealed,
+                                  is_grasped=self.grasp_verifier.is_sealed,
+                                  clock=uvc.get_time_monotonic,
+                                  sleep=self.wait,
+                                  release_position=release_position,
+                                  velocity_estimator=self.conveyor_velocity_estimator,
+                                  planner=planner)
+        report = tracker.run(max_picks=max_picks, max_cycles=max_cycles)
+        print(f"Conveyor tracking: {report.picks} picks, {report.throughput:.1f} picks/min, "
+              f"miss rate {report.miss_rate:.2f}")
+        return report
+
+    def __pick_at(self,
+                  bulk_image: np.ndarray,
+                  captured_at: float,
+                  pickable_points: np.ndarray,
+                  target_point: np.ndarray,
+                  distance_error: float,
+                  release_position: Optional[DobotPosition] = None) -> bool:
+        """
+        Try to pick up the item at the target point.
+        The cycle is recorded with the ERROR outcome before an exception is raised again.
+
+        :return: Whether the item has been grasped
+        """
+
+        transformed_target_point = None
+        raw_distance_sensor_values = []
+        try:
+            # Transform the coordinate
+            transformed_target_point = self.__transform(target_point)
+            above_target = DobotPosition(x=transformed_target_point[0],
+                                         y=transformed_target_point[1],
+                                         z=-25,
+                                         r_head=0)
+
+            # Measure the distance
+            measuring_distance_position = self.__measuring_distance_position(above_target=above_target)
+            self.move(destination=measuring_distance_position, wait=True)
+            self.wait(seconds=0.5)
+            raw_distance_sensor_values = self.distance_sensor.acquire_distance(times=60)
+            # Remove the obvious outliers
+            distance_sensor_values = (val for val in raw_distance_sensor_values if val < 130)
+            distance_sensor_value = median(distance_sensor_values)
+            distance = distance_sensor_value + distance_error - self.distance_sensor_displacement[2]
+            print(f"Distance: {distance}mm (sensor value: {distance_sensor_value}mm)")
+            target_position = above_target._replace(z=above_target.z-distance)
+
+            # Go to pick up at the heights planned for the measured item
+            if self.motion_planner is not None:
+                motion_plan = self.motion_planner.plan_pick(current_position=measuring_distance_position,
+                                                            target_position=target_position,
+                                                            destination=release_position,
+                                                            grasp_time=0.8 if self.grasp_verifier is None else
+                                                            self.grasp_verifier.timeout)
+                print(f"Predicted cycle time: {motion_plan.predicted_cycle_time:.2f}s")
+                self.follow(motion_plan=motion_plan.approach, wait=self.grasp_verifier is not None)
+            else:
+                self.move(destination=above_target, wait=False)
+                self.move(destination=target_position, wait=self.grasp_verifier is not None)
+            if self.grasp_verifier is None:
+                self.set_suction_cup(is_on=True)
+                self.wait(seconds=0.8)
+                is_sealed = True
+            else:
+                self.set_suction_cup(is_on=True)
+                verification = self.grasp_verifier.wait_for_seal()
+                is_sealed = verification.is_sealed
+                print(f"Sealed: {is_sealed} in {verification.elapsed * 1000:.1f}ms")
+                if not is_sealed:
+                    self.set_suction_cup(is_on=False)
+
+            # Retreat
+            if self.motion_planner is None:
+                above_target = above_target._replace(z=85)
+                self.move(destination=above_target)
+            elif is_sealed:
+                self.follow(motion_plan=motion_plan.retreat)
+            else:
+                # Stay above the bin to try the next candidate
+                self.follow(motion_plan=self.motion_planner.plan_pick(current_position=measuring_distance_position,
+                                                                      target_position=target_position,
+                                                                      held_item_height=0).retreat)
+
+            # The item can drop while lifting
+            if is_sealed and self.grasp_verifier is not None and not self.grasp_verifier.is_sealed():
+                print("Lost the seal while lifting")
+                self.set_suction_cup(is_on=False)
+                is_sealed = False
+
+            if self.motion_planner is None and is_sealed and release_position is not None:
+                self.move(destination=release_position)
+        except Exception as error:
+            self.__record_cycle(timestamp=captured_at,
+                                bulk_image=bulk_image,
+                                pickable_points=pickable_points,
+                                target_point=target_point,
+                                transformed_target_point=transformed_target_point,
+                                distance_sensor_values=raw_distance_sensor_values,
+                                outcome=PickCycleOutcome.ERROR,
+                                error=error)
+            raise
+
+        self.__record_cycle(timestamp=captured_at,
+                            bulk_image=bulk_image,
+                            pickable_points=pickable_points,
+                            target_point=target_point,
+                            transformed_target_point=transformed_target_point,
+                            distance_sensor_values=raw_distance_sensor_values,
+                            outcome=PickCycleOutcome.PICKED if is_sealed else PickCycleOutcome.GRASP_FAILED)
+        return is_sealed
+
+    def __record_cycle(self,
+                       timestamp: float,
+                       bulk_image: np.ndarray,
+                       pickable_points: np.ndarray,
+                       outcome: PickCycleOutcome,
+                       target_point: Optional[np.ndarray] = None,
+                       transformed_target_point: Optional[np.ndarray] = None,
+                       distance_sensor_values: List[int] = (),
+                       error: Optional[Exception] = None):
+        if self.pick_cycle_recorder is None:
+            return
+        self.pick_cycle_recorder.record(PickCycleRecord(timestamp=timestamp,
+                                                        bulk_image=bulk_image,
+                                                        pickable_points=pickable_points,
+                                                        target_point=target_point,
+                                                        transformed_target_point=transformed_target_point,
+                                                        distance_sensor_values=list(distance_sensor_values),
+                                                        outcome=outcome,
+                                                        error=None if error is None else
+                                                        f"{type(error).__name__}: {error}"))
+
+    @staticmethod
+    def __configure_bulk_camera(capture: uvc.Capture):
+        capture.frame_mode = (640, 480, 30)
+        controls = {control.display_name: control for control in capture.controls}
         controls['Auto Exposure Mode'].value = 1
         controls['Absolute Exposure Time'].value = 500
         controls['White Balance temperature,Auto'].value = 0
         controls['White Balance temperature'].value = 3000
         controls['Saturation'].value = 60
+
+    def __capture_bulk(self, undistorts: bool = True) -> np.ndarray:
         image = self.bulk_capture.get_frame_robust().img
         image = cv2.flip(image, 1)
+        if undistorts:
+            image = self.__undistort_image(image)
         return image
 
+    def __undistort_image(self, image: np.ndarray) -> np.ndarray:
+        if self.lens_undistorter is None or not self.lens_undistorter.is_calibrated or \
+                self.undistortion_mode != UndistortionMode.IMAGE:
+            return image
+        return self.lens_undistorter.undistort_image(image)
+
+    def __undistort_points(self, points: list) -> list:
+        if self.lens_undistorter is None or not self.lens_undistorter.is_calibrated or \
+                self.undistortion_mode != UndistortionMode.POINTS:
+            return points
+        return self.lens_undistorter.undistort_points(points).tolist()
+
+    def __transform(self, target_point: np.ndarray) -> np.ndarray:
+        return self.coordinate_transformer.predict(transforming_coordinate=self.__undistort_points([target_point])[0])
+
     def __measuring_distance_position(self, above_target: DobotPosition) -> DobotPosition:
         """
         Returns a position to measure the distance between the hand and the target.
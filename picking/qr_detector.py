@@ -12,12 +12,18 @@ def detect_qr(image: np.ndarray) -> Dict[int, tuple]:
     """
 
     aruco_dictionary = aruco.getPredefinedDictionary(aruco.DICT_6X6_250)
-    corners, qr_ids, _ = aruco.detectMarkers(image, aruco_dictionary)
+    if hasattr(aruco, "ArucoDetector"):  # OpenCV >= 4.7
+        corners, qr_ids, _ = aruco.ArucoDetector(aruco_dictionary).detectMarkers(image)
+    else:
+        corners, qr_ids, _ = aruco.detectMarkers(image, aruco_dictionary)
 
     qr_centers = {}  # {ID: (center.x, center.y)}
-    for qr_id, corner in zip(qr_ids, corners):
-        qr_id = int(qr_id[0])
-        corner = corner[0]
+    if qr_ids is None:
+        return qr_centers
+    # The shapes of the IDs and the corners differ between OpenCV versions
+    for qr_id, corner in zip(np.asarray(qr_ids).ravel(), corners):
+        qr_id = int(qr_id)
+        corner = np.asarray(corner).reshape(-1, 2)
         center = (corner[:, 0].mean(), corner[:, 1].mean())
         qr_centers[qr_id] = center
 
@@ -0,0 +1,116 @@
+from typing import Callable, List, Optional
+from ..device_registry import Backoff, DeviceIdentity, DeviceInfo, DeviceKind, DeviceNotFoundError, DeviceRegistry, \
+    retry_with_backoff
+from ..pyuvc import uvc
+
+
+class ReconnectingCapture:
+    """
+    UVC capture that keeps serving frames across USB glitches.
+    The same object stays valid for its users while the underlying uvc.Capture is reopened with backoff and
+    configured again when the camera is replugged.
+    Only a lost device causes reconnection. Timeouts and corrupt frames of a connected camera are raised as they are.
+    """
+
+    # Stream errors that mean the camera has gone
+    device_lost_messages = (uvc.uvc_error_codes[-4], uvc.uvc_error_codes[-1])  # No such device, I/O error
+
+    def __init__(self,
+                 device_registry: DeviceRegistry,
+                 identity: DeviceIdentity,
+                 configure: Callable[[uvc.Capture], None] = lambda capture: None,
+                 backoff: Backoff = Backoff()):
+        """
+        :param device_registry: Registry that enumerates UVC cameras
+        :param identity: USB identity of the camera
+        :param configure: Function that sets the frame mode and controls of a newly opened capture
+        :param backoff: Backoff of reconnection attempts
+        """
+
+        self.device_registry = device_registry
+        self.identity = identity
+        self.configure = configure
+        self.backoff = backoff
+        self.reconnection_count = 0
+        self.__is_stale = False
+        self.__callback_stream_options: Optional[dict] = None
+        self.__capture: Optional[uvc.Capture] = None
+        self.__capture = self.__open(refresh=False)
+        device_registry.add_listener(self.__on_devices_changed)
+
+    @property
+    def capture(self) -> uvc.Capture:
+        """
+        The currently opened capture. Do not keep it because it is replaced on reconnection.
+        Start callback streaming with `start_callback_stream` of this object, so that it is restarted on reconnection.
+        """
+
+        if self.__is_stale:
+            self.reconnect()
+        return self.__capture
+
+    def get_frame_robust(self):
+        return self.__with_reconnection(lambda capture: capture.get_frame_robust())
+
+    def get_frame(self, timeout: float = 0):
+        return self.__with_reconnection(lambda capture: capture.get_frame(timeout))
+
+    def get_frame_after(self, t: float, timeout: float = 1.0, margin: Optional[float] = None):
+        return self.__with_reconnection(lambda capture: capture.get_frame_after(t, timeout=timeout, margin=margin))
+
+    def start_callback_stream(self, **options):
+        """
+        Switch to callback streaming and keep it across reconnections.
+
+        :param options: Arguments of uvc.Capture.start_callback_stream
+        """
+
+        self.capture.start_callback_stream(**options)
+        self.__callback_stream_options = options
+
+    def stop_callback_stream(self):
+        self.capture.stop_callback_stream()
+        self.__callback_stream_options = None
+
+    def reconnect(self):
+        self.close()
+        self.__capture = retry_with_backoff(connect=lambda: self.__open(refresh=True),
+                                            exceptions=(uvc.InitError, DeviceNotFoundError),
+                                            backoff=self.backoff)
+        self.reconnection_count += 1
+
+    def close(self):
+        if self.__capture is not None:
+            try:
+                self.__capture.close()
+            except uvc.CaptureError:
+                pass
+            self.__capture = None
+
+    def __with_reconnection(self, get_frame):
+        try:
+            return get_frame(self.capture)
+        except uvc.InitError:
+            pass
+        except uvc.StreamError as error:
+            if error.message not in self.device_lost_messages:
+                # A timeout also happens when the camera has been unplugged in callback streaming
+                self.device_registry.refresh()
+                if not self.__is_stale:
+                    raise
+        self.reconnect()
+        return get_frame(self.__capture)
+
+    def __open(self, refresh: bool) -> uvc.Capture:
+        device = self.device_registry.find(kind=DeviceKind.UVC_CAMERA, identity=self.identity, refresh=refresh)
+        capture = uvc.Capture(device.address)
+        self.configure(capture)
+        if self.__callback_stream_options is not None:
+            capture.start_callback_stream(**self.__callback_stream_options)
+        self.__address = device.address
+        self.__is_stale = False
+        return capture
+
+    def __on_devices_changed(self, added: List[DeviceInfo], removed: List[DeviceInfo]):
+        if any(device.kind == DeviceKind.UVC_CAMERA and device.address == self.__address for device in removed):
+            self.__is_stale = True
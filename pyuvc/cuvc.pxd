@@ -413,7 +413,7 @@ cdef extern from  "libuvc/libuvc.h":
 
     uvc_frame_t *uvc_allocate_frame(size_t data_bytes)
     void uvc_free_frame(uvc_frame_t *frame)
-    uvc_error_t uvc_duplicate_frame(uvc_frame_t *in_frame, uvc_frame_t *out_frame)
+    uvc_error_t uvc_duplicate_frame(uvc_frame_t *in_frame, uvc_frame_t *out_frame) nogil
 
     int uvc_get_ctrl_len(uvc_device_handle_t *devh, uint8_t unit, uint8_t ctrl)
     int uvc_get_ctrl(uvc_device_handle_t *devh, uint8_t unit, uint8_t ctrl, void *data, int len, uvc_req_code req_code)
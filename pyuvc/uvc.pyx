@@ -10,6 +10,9 @@
 
 import cython
 from libc.string cimport memset
+from libc.stdlib cimport malloc, free
+from cpython.pythread cimport PyThread_type_lock, PyThread_allocate_lock, PyThread_free_lock, \
+    PyThread_acquire_lock, PyThread_release_lock, WAIT_LOCK, NOWAIT_LOCK, PyLockStatus, PY_LOCK_ACQUIRED
 cimport cuvc as uvc
 cimport cturbojpeg as turbojpeg
 cimport numpy as np
@@ -23,6 +26,9 @@ ELIF UNAME_SYSNAME == "Darwin":
 ELIF UNAME_SYSNAME == "Linux":
     include "linux_time.pxi"
 
+cdef extern from "pythread.h":
+    PyLockStatus PyThread_acquire_lock_timed(PyThread_type_lock lock, long long microseconds, int intr_flag) nogil
+
 uvc_error_codes = {  0:"Success (no error)",
                     -1:"Input/output error.",
                     -2:"Invalid parameter.",
@@ -407,6 +413,82 @@ def device_list():
 
 include 'controls.pxi'
 
+#drop policies of the callback stream queue when it is full
+cpdef enum drop_policy:
+    DROP_OLDEST = 0
+    DROP_NEWEST = 1
+
+cdef struct frame_queue_t:
+    uvc.uvc_frame_t **frames     #ring buffer of preallocated frames
+    uvc.uvc_frame_t *spare       #swapped with the head frame on dequeue, only touched by the consumer
+    int capacity
+    int head
+    int count
+    int drop_policy
+    bint ready_released          #True while the ready lock signals a waiting frame
+    PyThread_type_lock lock      #guards the ring buffer and the counters
+    PyThread_type_lock ready     #released by the producer when the queue becomes non-empty
+    unsigned long long received
+    unsigned long long dropped
+    unsigned long long late
+    unsigned long long decoded
+
+cdef frame_queue_t *frame_queue_new(int capacity, int drop_policy) except NULL:
+    cdef frame_queue_t *q = <frame_queue_t*>malloc(sizeof(frame_queue_t))
+    cdef int i
+    if q == NULL:
+        raise MemoryError()
+    memset(q, 0, sizeof(frame_queue_t))
+    q.frames = <uvc.uvc_frame_t**>malloc(capacity * sizeof(uvc.uvc_frame_t*))
+    if q.frames == NULL:
+        free(q)
+        raise MemoryError()
+    #frames allocated with 0 bytes own their data and grow to the jpeg size on first use
+    for i in range(capacity):
+        q.frames[i] = uvc.uvc_allocate_frame(0)
+    q.spare = uvc.uvc_allocate_frame(0)
+    q.capacity = capacity
+    q.drop_policy = drop_policy
+    q.lock = PyThread_allocate_lock()
+    q.ready = PyThread_allocate_lock()
+    #the ready lock starts acquired: nothing to consume yet
+    PyThread_acquire_lock(q.ready, WAIT_LOCK)
+    return q
+
+cdef void frame_queue_free(frame_queue_t *q):
+    cdef int i
+    if q == NULL:
+        return
+    for i in range(q.capacity):
+        uvc.uvc_free_frame(q.frames[i])
+    uvc.uvc_free_frame(q.spare)
+    free(q.frames)
+    PyThread_free_lock(q.ready)
+    PyThread_free_lock(q.lock)
+    free(q)
+
+cdef void on_frame_received(uvc.uvc_frame *frame, void *user_ptr) noexcept nogil:
+    #runs on the libuvc stream thread without the GIL
+    cdef frame_queue_t *q = <frame_queue_t*>user_ptr
+    cdef int tail
+    PyThread_acquire_lock(q.lock, WAIT_LOCK)
+    q.received += 1
+    if q.count == q.capacity:
+        q.dropped += 1
+        if q.drop_policy == DROP_NEWEST:
+            PyThread_release_lock(q.lock)
+            return
+        q.head = (q.head + 1) % q.capacity
+        q.count -= 1
+    tail = (q.head + q.count) % q.capacity
+    uvc.uvc_duplicate_frame(frame, q.frames[tail])
+    q.count += 1
+    if not q.ready_released:
+        q.ready_released = True
+        PyThread_release_lock(q.ready)
+    PyThread_release_lock(q.lock)
+
+
 cdef class Capture:
     """
     Video Capture class.
@@ -425,6 +507,8 @@ cdef class Capture:
     cdef bint _stream_on,_configured
     cdef uvc.uvc_stream_handle_t *strmh
     cdef float _bandwidth_factor
+    cdef frame_queue_t *_queue
+    cdef double _late_threshold
 
     cdef tuple _active_mode
     cdef list _available_modes
@@ -443,6 +527,8 @@ cdef class Capture:
         self._info = {}
         self.controls = []
         self._bandwidth_factor = 2.0
+        self._queue = NULL
+        self._late_threshold = 0.1
 
     def __init__(self,dev_uid):
 
@@ -537,12 +623,26 @@ cdef class Capture:
 
     cdef _start(self):
         cdef int status
+        cdef frame_queue_t *q = self._queue
         if not self._configured:
             self._configure_stream()
         status = uvc.uvc_stream_open_ctrl(self.devh, &self.strmh, &self.ctrl)
         if status != uvc.UVC_SUCCESS:
             raise InitError("Can't open stream control: Error:'%s'."%uvc_error_codes[status])
-        status = uvc.uvc_stream_start(self.strmh, NULL, NULL,self._bandwidth_factor,0)
+        if q != NULL:
+            #frames queued before the restart are stale. Also take back the ready signal of a queued frame,
+            #otherwise the next pop would return a stale frame and drive count below 0.
+            with nogil:
+                PyThread_acquire_lock(q.lock, WAIT_LOCK)
+                q.head = 0
+                q.count = 0
+                q.ready_released = False
+                PyThread_acquire_lock(q.ready, NOWAIT_LOCK)
+                PyThread_release_lock(q.lock)
+            status = uvc.uvc_stream_start(self.strmh, <uvc.uvc_frame_callback_t*>on_frame_received,
+                                          <void*>self._queue, self._bandwidth_factor, 0)
+        else:
+            status = uvc.uvc_stream_start(self.strmh, NULL, NULL,self._bandwidth_factor,0)
         if status != uvc.UVC_SUCCESS:
             raise InitError("Can't start isochronous stream: Error:'%s'."%uvc_error_codes[status])
         self._stream_on = 1
@@ -552,6 +652,32 @@ cdef class Capture:
     def stop_stream(self):
         self._stop()
 
+    def start_callback_stream(self, queue_size=2, drop_policy=DROP_OLDEST, late_threshold=0.1):
+        '''
+        Switch to callback streaming.
+
+        libuvc delivers frames on its own thread without the GIL and pushes them into a bounded native queue.
+        get_frame() and get_frame_robust() then pop from this queue instead of polling the stream.
+        When the queue is full a frame is dropped according to drop_policy (DROP_OLDEST or DROP_NEWEST).
+        A frame counts as late when it is older than late_threshold seconds once it is popped.
+        '''
+        if queue_size < 1:
+            raise ValueError("Queue size must be at least 1.")
+        if drop_policy not in (DROP_OLDEST, DROP_NEWEST):
+            raise ValueError("Drop policy not supported.")
+        if self._stream_on:
+            self._stop()
+        frame_queue_free(self._queue)
+        self._queue = frame_queue_new(queue_size, drop_policy)
+        self._late_threshold = late_threshold
+        self._start()
+
+    def stop_callback_stream(self):
+        if self._stream_on:
+            self._stop()
+        frame_queue_free(self._queue)
+        self._queue = NULL
+
     cdef _stop(self):
         cdef int status = 0
         status = uvc.uvc_stream_stop(self.strmh)
@@ -579,13 +705,61 @@ cdef class Capture:
                 return frame
         raise StreamError("Could not grab frame after 3 attempts. Giving up.")
 
+    def get_frame_after(self,t,timeout=1.0,margin=None):
+        '''
+        Return the first frame whose timestamp is not earlier than t + margin.
+
+        t is on the get_time_monotonic() clock. Frames exposed before t are discarded.
+        The timestamp is taken when a frame has been transferred, so a frame exposed partly before t
+        can still have a later timestamp. margin covers that latency in seconds and defaults to
+        exposure_latency(). Pass 0 to compare the timestamps only.
+        Raise StreamError if no such frame arrives within timeout seconds.
+        '''
+        if margin is None:
+            margin = self.exposure_latency()
+        cdef double earliest = t + margin
+        cdef double deadline = get_sys_time_monotonic() + timeout
+        cdef double remaining
+        cdef int discarded = 0
+        while True:
+            remaining = deadline - get_sys_time_monotonic()
+            if remaining <= 0:
+                raise StreamError("No frame captured after %s within %ss (%s discarded)."%(earliest,timeout,discarded))
+            try:
+                frame = self.get_frame(remaining)
+            except StreamError as e:
+                logger.debug('Could not get Frame: "%s". Retrying until deadline.'%e.message)
+                continue
+            if frame.timestamp >= earliest:
+                return frame
+            discarded += 1
+
+    def exposure_latency(self):
+        '''
+        Seconds from the start of an exposure to the frame timestamp: the exposure time plus one frame interval.
+        The exposure time is read from the 'Absolute Exposure Time' control and ignored if it is unavailable.
+        '''
+        cdef double latency = 0
+        if self._configured and self.frame_rate:
+            latency += 1./self.frame_rate
+        for control in self.controls:
+            if control.display_name == 'Absolute Exposure Time':
+                try:
+                    latency += control.value * 1e-4 #units of 100 usec
+                except Exception as e:
+                    logger.debug('Could not read exposure time: "%s".'%e)
+                break
+        return latency
+
 
 
     def get_frame(self,timeout=0):
         cdef int status, j_width,j_height,jpegSubsamp,header_ok
-        cdef int  timeout_usec = int(timeout*1e6) #sec to usec
+        cdef int  timeout_usec = max(1,int(timeout*1e6)) if timeout > 0 else 0 #sec to usec, 0 waits forever
         if not self._stream_on:
             self._start()
+        if self._queue != NULL:
+            return self._get_queued_frame(timeout)
         cdef uvc.uvc_frame *uvc_frame = NULL
         #when this is called we will overwrite the last jpeg buffer! This can be dangerous!
         with nogil:
@@ -605,6 +779,48 @@ cdef class Capture:
         out_frame.timestamp = uvc_frame.capture_time.tv_sec + <double>uvc_frame.capture_time.tv_usec * 1e-6
         return out_frame
 
+    cdef _get_queued_frame(self,timeout):
+        cdef int j_width,j_height,jpegSubsamp,header_ok
+        cdef long long timeout_usec = int(timeout*1e6) if timeout > 0 else -1 #sec to usec, -1 waits forever
+        cdef PyLockStatus status
+        cdef frame_queue_t *q = self._queue
+        cdef uvc.uvc_frame *uvc_frame
+        with nogil:
+            status = PyThread_acquire_lock_timed(q.ready, timeout_usec, 0)
+        if status != PY_LOCK_ACQUIRED:
+            raise StreamError(uvc_error_codes[uvc.UVC_ERROR_TIMEOUT])
+
+        #swap the head frame with the spare one so the producer can keep writing while we decode
+        with nogil:
+            PyThread_acquire_lock(q.lock, WAIT_LOCK)
+            uvc_frame = q.frames[q.head]
+            q.frames[q.head] = q.spare
+            q.spare = uvc_frame
+            q.head = (q.head + 1) % q.capacity
+            q.count -= 1
+            q.ready_released = q.count > 0
+            if q.ready_released:
+                PyThread_release_lock(q.ready)
+            PyThread_release_lock(q.lock)
+
+        ##check jpeg header
+        header_ok = turbojpeg.tjDecompressHeader2(self.tj_context,  <unsigned char *>uvc_frame.data, uvc_frame.data_bytes, &j_width, &j_height, &jpegSubsamp)
+        if not (header_ok >=0 and uvc_frame.width == j_width and uvc_frame.height == j_height):
+            raise StreamError("JPEG header corrupt.")
+
+        cdef Frame out_frame = Frame()
+        out_frame.tj_context = self.tj_context
+        out_frame.attach_uvcframe(uvc_frame = uvc_frame,copy=True)
+        out_frame.timestamp = uvc_frame.capture_time.tv_sec + <double>uvc_frame.capture_time.tv_usec * 1e-6
+        if get_sys_time_monotonic() - out_frame.timestamp > self._late_threshold:
+            q.late += 1
+        q.decoded += 1
+        return out_frame
+
+    def __iter__(self):
+        while True:
+            yield self.get_frame_robust()
+
 
     cdef _enumerate_controls(self):
 
@@ -686,6 +902,8 @@ cdef class Capture:
     def close(self):
         if self._stream_on:
             self._stop()
+        frame_queue_free(self._queue)
+        self._queue = NULL
         if self.devh != NULL:
             self._de_init_device()
         if self.ctx != NULL:
@@ -757,6 +975,24 @@ cdef class Capture:
         def __get__(self):
             return self._info['name']
 
+    property stream_stats:
+        def __get__(self):
+            '''
+            Counters of the callback stream since start_callback_stream() or None in polling mode.
+            '''
+            cdef frame_queue_t *q = self._queue
+            if q == NULL:
+                return None
+            with nogil:
+                PyThread_acquire_lock(q.lock, WAIT_LOCK)
+            stats = {'received':q.received,
+                     'dropped':q.dropped,
+                     'late':q.late,
+                     'decoded':q.decoded,
+                     'queued':q.count}
+            PyThread_release_lock(q.lock)
+            return stats
+
     property bandwidth_factor:
         def __get__(self):
             return self._bandwidth_factor
@@ -9,6 +9,7 @@ DISTANCE_SENSOR_DISPLACEMENT = (50, 0, 40)
 
 # Dobot configuration
 PICKER_PORT = '/dev/ttyXXXX'
+PICKER_IDENTITY = None  # e.g. DeviceIdentity(product_id=..., vendor_id=...) listed by device_registry.py. Overrides the port.
 PICKER_HOME = DobotPosition(x=250, y=0, z=100, r_head=0)
 ABOVE_BULK = DobotPosition(x=200, y=100, z=100, r_head=0)
 RELEASE_POSITION = DobotPosition(x=200, y=0, z=0, r_head=0)
@@ -19,6 +20,7 @@ if __name__ == "__main__":
                          coordinate_transformer=CoordinateTransformer(model_path=COORD_TRANS_MODEL_PATH),
                          distance_displacement=DISTANCE_SENSOR_DISPLACEMENT,
                          port_name=PICKER_PORT,
+                         dobot_identity=PICKER_IDENTITY,
                          home=PICKER_HOME)
     picker.move(destination=ABOVE_BULK)
     picker.pick_from_bulk(distance_error=0, show_pickable_points=True)
@@ -1,7 +1,13 @@
 import struct
-from typing import NamedTuple
+import functools
+import threading
+from enum import IntEnum
+from typing import List, NamedTuple, Optional
+from serial import SerialException
 from pydobot.dobot import Dobot, MODE_PTP_MOVJ_XYZ, MODE_PTP_MOVJ_ANGLE
 from pydobot.message import Message
+from .device_registry import Backoff, DeviceIdentity, DeviceInfo, DeviceKind, DeviceNotFoundError, DeviceRegistry, \
+    retry_with_backoff
 
 
 class DobotPosition(NamedTuple):
@@ -18,19 +24,71 @@ class DobotJointAngles(NamedTuple):
     joint4: float
 
 
+class DobotIOFunction(IntEnum):
+    DUMMY = 0
+    DIGITAL_OUTPUT = 1
+    PWM = 2
+    DIGITAL_INPUT = 3
+    ADC = 4
+    DIGITAL_INPUT_PULL_UP = 5
+    DIGITAL_INPUT_PULL_DOWN = 6
+
+
 class DobotActivationError(Exception):
     pass
 
 
+def reconnecting(command):
+    """
+    Reconnect Dobot and run the command again if the serial port has been lost before or during the command.
+    Only for commands that are safe to repeat, e.g. moves to absolute positions.
+    """
+
+    @functools.wraps(command)
+    def wrapper(self: "DobotController", *args, **kwargs):
+        if self.is_reconnecting:  # Called while setting Dobot up again. `reconnect` handles the failure.
+            return command(self, *args, **kwargs)
+        if self.is_disconnected:
+            self.reconnect()
+        try:
+            return command(self, *args, **kwargs)
+        except SerialException as error:
+            print(f"Lost Dobot on port {self.port_name}: {error}. Reconnecting.")
+            self.reconnect()
+            return command(self, *args, **kwargs)
+    return wrapper
+
+
 class DobotController:
 
     default_home = DobotPosition(x=250, y=0, z=100, r_head=0)
     default_ptp_mode = MODE_PTP_MOVJ_XYZ
 
-    def __init__(self, port_name: str = "", home: DobotPosition = default_home):
+    def __init__(self,
+                 port_name: str = "",
+                 home: DobotPosition = default_home,
+                 device_identity: Optional[DeviceIdentity] = None,
+                 device_registry: Optional[DeviceRegistry] = None,
+                 backoff: Backoff = Backoff()):
+        """
+        :param port_name: Serial port name of Dobot. Ignored if `device_identity` is specified.
+        :param home: Home position
+        :param device_identity: USB identity of Dobot to look up its port in the registry instead of a fixed port name
+        :param device_registry: Registry shared with the other components. A registry of serial ports is created if None.
+        :param backoff: Backoff of reconnection attempts
+        """
+
+        self.device_identity = device_identity
+        self.device_registry = device_registry or DeviceRegistry()
+        if device_identity is not None:
+            port_name = self.device_registry.find(kind=DeviceKind.SERIAL_PORT, identity=device_identity).address
         self.dobot = Dobot(port=port_name)
         self.port_name = port_name
         self.home = home
+        self.backoff = backoff
+        self.is_disconnected = False  # Set when the registry notices that the port has been removed
+        self.is_reconnecting = False
+        self.device_registry.add_listener(self.__on_devices_changed)
 
     def activate(self):
         """
@@ -62,6 +120,44 @@ class DobotController:
         self.dobot._set_queued_cmd_stop_exec()
         self.dobot.close()
 
+    def reconnect(self):
+        """
+        Reopen the serial port after a USB glitch and set Dobot up again, keeping this controller and its Dobot object.
+        The port is looked up again if Dobot is identified by `device_identity`.
+        Commands decorated with `reconnecting` call this automatically and run again.
+        `move_with_conveyor` is not repeated because the conveyor may have moved already.
+        """
+
+        try:
+            self.dobot.ser.close()
+        except SerialException:
+            pass
+        # The interrupted command can leave the lock acquired
+        self.dobot.lock = threading.Lock()
+
+        def open_port():
+            if self.device_identity is not None:
+                self.port_name = self.device_registry.find(kind=DeviceKind.SERIAL_PORT,
+                                                           identity=self.device_identity,
+                                                           refresh=True).address
+                self.dobot.ser.port = self.port_name
+            self.dobot.ser.open()
+
+        self.is_reconnecting = True
+        try:
+            retry_with_backoff(connect=open_port,
+                               exceptions=(SerialException, DeviceNotFoundError),
+                               backoff=self.backoff)
+            self.dobot._on = True
+            self.is_disconnected = False
+            self.activate()
+        finally:
+            self.is_reconnecting = False
+
+    def __on_devices_changed(self, added: List[DeviceInfo], removed: List[DeviceInfo]):
+        if any(device.kind == DeviceKind.SERIAL_PORT and device.address == self.port_name for device in removed):
+            self.is_disconnected = True
+
     # ---------- Setups ---------- #
 
     def set_home(self, home: DobotPosition):
@@ -76,6 +172,7 @@ class DobotController:
         self.dobot._send_message(message)
         self.home = home
 
+    @reconnecting
     def set_conveyor_connected(self, is_connected: bool):
         message = Message()
         message.id = 3
@@ -83,24 +180,36 @@ class DobotController:
         message.params = bytearray([is_connected])
         self.dobot._send_command(message, wait=True)
 
-    def set_io_multiplexing(self, address: int, multiplex: int):
+    @reconnecting
+    def set_io_multiplexing(self, address: int, multiplex: DobotIOFunction):
+        """
+        Set the function of an I/O port.
+
+        :param address: I/O port address(1~20)
+        :param multiplex: Function of the port, e.g. DobotIOFunction.ADC before calling `io_adc`
+        """
+
         message = Message()
         message.id = 130
         message.ctrl = 0x03
-        assert False  # TODO: Implement
+        message.params = bytearray([address, multiplex])
+        self.dobot._send_command(message, wait=True)
 
     # ---------- Readers ---------- #
 
     @property
+    @reconnecting
     def current_position(self) -> DobotPosition:
         x, y, z, r, _, _, _, _ = self.dobot.pose()
         return DobotPosition(x=x, y=y, z=z, r_head=r)
 
     @property
+    @reconnecting
     def current_joint_angles(self) -> DobotJointAngles:
         _, _, _, _, j1, j2, j3, j4 = self.dobot.pose()
         return DobotJointAngles(joint1=j1, joint2=j2, joint3=j3, joint4=j4)
 
+    @reconnecting
     def io_adc(self, address: int) -> int:
         """
         Read the I/O analog-digital conversion value.
@@ -112,11 +221,14 @@ class DobotController:
         message = Message()
         message.id = 134
         message.params = bytearray([address])
-        response = self.dobot._send_command(message, wait=True)
-        assert False  # TODO: Return correct value
+        response = self.dobot._send_command(message)
+        # Response params: address (uint8), value (uint16)
+        _, value = struct.unpack_from('<BH', response.params, 0)
+        return value
 
     # ---------- Instructions ---------- #
 
+    @reconnecting
     def calibrate(self):
         message = Message()
         message.id = 31
@@ -125,6 +237,7 @@ class DobotController:
         self.dobot._send_message(message)
         self.dobot.lock.release()
 
+    @reconnecting
     def move(self, destination: DobotPosition, ptp_mode=default_ptp_mode, wait: bool = True):
         self.dobot._set_ptp_cmd(x=destination.x,
                                 y=destination.y,
@@ -168,6 +281,7 @@ class DobotController:
                                 conveyor_position=conveyor_position,
                                 ptp_mode=ptp_mode)
 
+    @reconnecting
     def set_joint_angles(self, angles: DobotJointAngles, ptp_mode=MODE_PTP_MOVJ_ANGLE, wait: bool = True):
         self.dobot._set_ptp_cmd(x=angles.joint1,
                                 y=angles.joint2,
@@ -176,9 +290,11 @@ class DobotController:
                                 mode=ptp_mode,
                                 wait=wait)
 
+    @reconnecting
     def set_suction_cup(self, is_on: bool):
         self.dobot.suck(enable=is_on)
 
+    @reconnecting
     def set_gripper(self, is_on: bool):
         self.dobot.grip(enable=is_on)
 